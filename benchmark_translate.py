@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+A benchmark harness for translate_transcript_to_genomic_coords.py. It generates a seeded synthetic genome mapping
+file and transcript processing file, then times the load, compile and query stages of the translation workflow for
+each mapping engine and reports throughput and peak memory.
+
+Example:
+python3 benchmark_translate.py --transcripts 20000 --queries 1000000 --modes block lazy numpy bytes index
+"""
+
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from math import log10
+
+import translate_transcript_to_genomic_coords as translate
+
+MODES = ("per-base", "block", "lazy", "numpy", "bytes", "index")
+
+
+# Function that writes a synthetic genome mapping file and returns a list of (transcript id, transcript length)
+# Each transcript has 1..max_exons exons separated by introns of up to max_intron bases (log-uniform lengths),
+# with occasional small insertions and deletions inside exons and soft clips at either end
+def generate_mapping_file(path, n_transcripts, max_exons, max_intron, indel_rate, soft_clip_rate, n_chroms, seed):
+    rng = random.Random(seed)
+    transcripts = []
+    mapping_file = open(path, "w")
+    for i in range(n_transcripts):
+        tr_id = "TR%d" % i
+        cigar = []
+        tr_length = 0
+        if rng.random() < soft_clip_rate:
+            clip = rng.randint(1, 20)
+            cigar.append("%dS" % clip)
+            tr_length += clip
+
+        n_exons = rng.randint(1, max_exons)
+        for exon in range(n_exons):
+            if exon > 0:
+                cigar.append("%dN" % int(round(10 ** rng.uniform(1.7, max(1.7, log10(max(max_intron, 1)))))))
+            remaining = rng.randint(50, 300)
+            while remaining > 0:
+                block = min(remaining, rng.randint(20, 300))
+                cigar.append("%dM" % block)
+                tr_length += block
+                remaining -= block
+                if remaining > 0 and rng.random() < indel_rate:
+                    if rng.random() < 0.5:
+                        insertion = rng.randint(1, 5)
+                        cigar.append("%dI" % insertion)
+                        tr_length += insertion
+                    else:
+                        cigar.append("%dD" % rng.randint(1, 5))
+
+        if rng.random() < soft_clip_rate:
+            clip = rng.randint(1, 20)
+            cigar.append("%dS" % clip)
+            tr_length += clip
+
+        mapping_file.write("%s\tCHR%d\t%d\t%s\n" % (tr_id, rng.randint(1, n_chroms), rng.randint(0, 200000000),
+                                                   "".join(cigar)))
+        transcripts.append((tr_id, tr_length))
+    mapping_file.close()
+    return transcripts
+
+
+# Function that writes a synthetic transcript processing file of n_queries queries
+# A fraction hit_ratio of the queries fall inside a known transcript; the rest are split between unknown transcript
+# ids and coordinates past the end of the transcript. Transcripts are drawn with Zipf weights 1 / rank ** skew,
+# so skew=0 queries all transcripts uniformly and larger values concentrate the queries on a few transcripts
+def generate_query_file(path, transcripts, n_queries, hit_ratio, skew, seed):
+    rng = random.Random(seed + 1)
+    order = list(range(len(transcripts)))
+    rng.shuffle(order)
+    cum_weights = []
+    total = 0.0
+    for rank in range(len(order)):
+        total += 1.0 / (rank + 1) ** skew
+        cum_weights.append(total)
+
+    query_file = open(path, "w")
+    batch = []
+    for i in range(n_queries):
+        tr_id, tr_length = transcripts[rng.choices(order, cum_weights=cum_weights)[0]]
+        if rng.random() < hit_ratio:
+            batch.append("%s\t%d\n" % (tr_id, rng.randrange(tr_length)))
+        elif rng.random() < 0.5:
+            batch.append("MISSING%d\t%d\n" % (i, rng.randrange(tr_length)))
+        else:
+            batch.append("%s\t%d\n" % (tr_id, tr_length + rng.randint(0, 1000)))
+        if len(batch) >= 65536:
+            query_file.write("".join(batch))
+            batch = []
+    query_file.write("".join(batch))
+    query_file.close()
+
+
+# Function that compiles every transcript into the per-base dict of "generate_genomic_dict", the original mapping
+# engine, so that the block based engines can be compared against it
+def map_coordinates_per_base(transcript_to_genomic_dict):
+    coord_map = {}
+    for tr in transcript_to_genomic_dict:
+        coord_map[tr] = translate.TranscriptLoci([
+            (alignment.chrom, translate.generate_genomic_dict(alignment.start_coord,
+                                                              translate.unpack_cigar(alignment.cigar),
+                                                              alignment.reverse))
+            for alignment in transcript_to_genomic_dict[tr]])
+    return coord_map
+
+
+# Function that runs the load, compile and query stages of one mode and returns their timings
+def run_mode(mode, mapping_path, query_path, output_path, index_path):
+    timings = {}
+
+    start = time.perf_counter()
+    if mode == "index":
+        translate.build_index_file(translate.create_transcript_genomic_dict(mapping_path), index_path)
+        timings["build_index"] = time.perf_counter() - start
+        start = time.perf_counter()
+        coord_map = translate.MappedCoordMap(index_path)
+        timings["load"] = time.perf_counter() - start
+        timings["compile"] = 0.0
+    else:
+        alignments = translate.create_transcript_genomic_dict(mapping_path)
+        timings["load"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if mode == "per-base":
+            coord_map = map_coordinates_per_base(alignments)
+        elif mode == "lazy":
+            coord_map = translate.LazyCoordMap(alignments)
+        else:
+            coord_map = translate.map_coordinates(alignments)
+        timings["compile"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    devnull = open(os.devnull, "w")
+    with redirect_stdout(devnull):
+        translate.merge_transcript_file(query_path, coord_map, output_path,
+                                        mode if mode in ("numpy", "bytes") else "python")
+    devnull.close()
+    timings["query"] = time.perf_counter() - start
+    return timings
+
+
+# Function run in a forked child so that every mode starts from the same memory state and reports its own peak RSS
+def run_mode_in_child(connection, mode, mapping_path, query_path, output_path, index_path):
+    timings = run_mode(mode, mapping_path, query_path, output_path, index_path)
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings["peak_rss_mb"] = peak_rss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+    connection.send(timings)
+    connection.close()
+
+
+# Function that benchmarks each mode in its own process and returns a list of result dictionaries
+def run_benchmark(modes, mapping_path, query_path, output_path, index_path, n_rows, n_queries):
+    context = multiprocessing.get_context("fork")
+    results = []
+    for mode in modes:
+        parent_connection, child_connection = context.Pipe(duplex=False)
+        child = context.Process(target=run_mode_in_child,
+                                args=(child_connection, mode, mapping_path, query_path, output_path, index_path))
+        child.start()
+        timings = parent_connection.recv()
+        child.join()
+
+        timings["mode"] = mode
+        timings["rows_per_sec"] = n_rows / timings["load"] if timings["load"] > 0 else 0.0
+        timings["queries_per_sec"] = n_queries / timings["query"] if timings["query"] > 0 else 0.0
+        results.append(timings)
+    return results
+
+
+# Function that prints the benchmark results as a table
+def print_results(results):
+    print("%-9s %10s %10s %10s %14s %14s %12s" % ("mode", "load s", "compile s", "query s", "rows/s", "queries/s",
+                                                    "peak RSS MB"))
+    for result in results:
+        print("%-9s %10.3f %10.3f %10.3f %14.0f %14.0f %12.1f" % (
+            result["mode"], result["load"], result["compile"], result["query"], result["rows_per_sec"],
+            result["queries_per_sec"], result["peak_rss_mb"]))
+
+
+######################################################################
+######################################################################
+#######  MAIN  #######################################################
+######################################################################
+######################################################################
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--transcripts", type=int, default=10000, dest="transcripts",
+                        help="number of transcripts in the generated genome mapping file. Default: 10000")
+    parser.add_argument("--max-exons", type=int, default=12, dest="max_exons",
+                        help="maximum number of exons per transcript. Default: 12")
+    parser.add_argument("--max-intron", type=int, default=1000000, dest="max_intron",
+                        help="maximum intron length in bases. Default: 1000000")
+    parser.add_argument("--indel-rate", type=float, default=0.05, dest="indel_rate",
+                        help="probability of an insertion or deletion between exon blocks. Default: 0.05")
+    parser.add_argument("--soft-clip-rate", type=float, default=0.1, dest="soft_clip_rate",
+                        help="probability of a soft clip at each transcript end. Default: 0.1")
+    parser.add_argument("--chromosomes", type=int, default=24, dest="chromosomes",
+                        help="number of chromosomes. Default: 24")
+    parser.add_argument("--queries", type=int, default=200000, dest="queries",
+                        help="number of queries in the generated transcript processing file. Default: 200000")
+    parser.add_argument("--hit-ratio", type=float, default=0.9, dest="hit_ratio",
+                        help="fraction of queries inside a known transcript. Default: 0.9")
+    parser.add_argument("--skew", type=float, default=1.0, dest="skew",
+                        help="Zipf exponent of the transcript query distribution (0 = uniform). Default: 1.0")
+    parser.add_argument("--seed", type=int, default=1, dest="seed",
+                        help="random seed of the generated inputs. Default: 1")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=["block", "lazy", "index"], dest="modes",
+                        help="mapping engines to benchmark. per-base expands every transcript base by base like "
+                             "the original implementation, and bytes answers the queries of block with the bytes "
+                             "engine. Default: block lazy index")
+    parser.add_argument("--workdir", default=".", dest="workdir",
+                        help="directory for the generated inputs and outputs. Default: current directory")
+    parser.add_argument("--json", dest="json_file",
+                        help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if "numpy" in args.modes and translate.np is None:
+        sys.stderr.write("The numpy mode requires NumPy to be installed\n")
+        sys.exit(-1)
+    if not os.path.isdir(args.workdir):
+        sys.stderr.write("Work directory does not exist\n")
+        sys.exit(-1)
+
+    mapping_path = os.path.join(args.workdir, "bench_mapping.txt")
+    query_path = os.path.join(args.workdir, "bench_queries.txt")
+    output_path = os.path.join(args.workdir, "bench_output.txt")
+    index_path = os.path.join(args.workdir, "bench_mapping.idx")
+
+    transcript_lengths = generate_mapping_file(mapping_path, args.transcripts, args.max_exons, args.max_intron,
+                                               args.indel_rate, args.soft_clip_rate, args.chromosomes, args.seed)
+    generate_query_file(query_path, transcript_lengths, args.queries, args.hit_ratio, args.skew, args.seed)
+
+    benchmark_results = run_benchmark(args.modes, mapping_path, query_path, output_path, index_path,
+                                      args.transcripts, args.queries)
+    print_results(benchmark_results)
+    if args.json_file is not None:
+        json_file = open(args.json_file, "w")
+        json.dump(benchmark_results, json_file, indent=2)
+        json_file.close()
@@ -0,0 +1,637 @@
+#!/usr/bin/env python3
+"""
+Tests for translate_transcript_to_genomic_coords.py
+
+Run with:
+python3 -m unittest test_translate_transcript_to_genomic_coords
+"""
+
+import gzip
+import io
+import json
+import os
+import random
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import zlib
+from contextlib import redirect_stdout
+from unittest import mock
+
+import translate_transcript_to_genomic_coords as translate
+
+
+# Function that returns the alignments of a list of (transcript id, chr, start coordinate, cigar[, strand]) rows
+def alignments_of(rows, all_loci=False):
+    transcript_to_genomic_dict = {}
+    for row in rows:
+        translate.add_genome_mapping_row(transcript_to_genomic_dict, [str(field) for field in row], all_loci)
+    return transcript_to_genomic_dict
+
+
+# Function that translates the query text with the engine, and returns the output text and the reported misses
+def translate_queries(engine, coord_map, query_text):
+    output_lines = []
+    misses = []
+    translate.get_query_translator(engine)(
+        translate.query_lines_from_bytes(query_text.encode("utf-8"), engine), coord_map, output_lines.append,
+        lambda reason, tr_id, tr_coord: misses.append((reason, tr_id, tr_coord)))
+    output = translate.join_output_lines(output_lines, engine)
+    return output.decode("utf-8") if engine == "bytes" else output, misses
+
+
+class EngineTest(unittest.TestCase):
+    def test_coordinates_beyond_int64_are_unmapped(self):
+        coord_map = translate.map_coordinates(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M")]))
+        query_text = "TR1\t99999999999999999999\nTR9\t99999999999999999999\nTR1\t9223372036854775807\nTR1\t4\n"
+        engines = [engine for engine in translate.ENGINES if engine != "numpy" or translate.np is not None]
+        for engine in engines:
+            self.assertEqual(translate_queries(engine, coord_map, query_text), (
+                "TR1\t4\tCHR1\t7\n",
+                [(translate.MISS_UNMAPPED_COORDINATE, "TR1", "99999999999999999999"),
+                 (translate.MISS_UNKNOWN_TRANSCRIPT, "TR9", "99999999999999999999"),
+                 (translate.MISS_UNMAPPED_COORDINATE, "TR1", "9223372036854775807")]), engine)
+
+    @unittest.skipIf(translate.np is None, "requires numpy")
+    def test_numpy_batches_keep_query_order(self):
+        coord_map = translate.map_coordinates(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M"),
+                                                             ("TR2", "CHR2", 10, "20M")]))
+        query_text = "TR1\t4\nTR2\t0 \nTR9\t1\nTR1\t0\t30\nTR1\t14\nTR2\t5\t8\nTR2\t3\nTR1\t30\nTR2\t7\n"
+        expected = translate_queries("python", coord_map, query_text)
+        for batch_lines in (1, 2, 3, 4, 100):
+            with mock.patch.object(translate, "NUMPY_BATCH_LINES", batch_lines):
+                self.assertEqual(translate_queries("numpy", coord_map, query_text), expected, batch_lines)
+
+
+class RangeQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.coord_map = translate.map_coordinates(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M"),
+                                                                  ("TRM", "CHR2", 100, "5M10N5M", "-")]))
+
+    def test_get_range_splits_at_gaps(self):
+        self.assertEqual(self.coord_map["TR1"].loci[0][1].get_range(0, 30),
+                         [(0, 8, 3, 11), (8, 14, 18, 24), (16, 18, 24, 26), (18, 25, 37, 44)])
+        self.assertEqual(self.coord_map["TR1"].loci[0][1].get_range(10, 17), [(10, 14, 20, 24), (16, 17, 24, 25)])
+        self.assertEqual(self.coord_map["TR1"].loci[0][1].get_range(14, 16), [])
+        # minus strand pieces are in transcript order, with genomic start < end
+        self.assertEqual(self.coord_map["TRM"].get_range(0, 10), [("CHR2", 0, 5, 115, 120), ("CHR2", 5, 10, 100, 105)])
+        self.assertEqual(self.coord_map["TRM"].get_range(3, 7), [("CHR2", 3, 5, 115, 117), ("CHR2", 5, 7, 103, 105)])
+
+    def test_get_range_matches_generate_genomic_dict(self):
+        for seed in range(3):
+            rng = random.Random(seed)
+            for row in random_mapping_rows(seed):
+                cigar_arr = [[int(cigar_int), cigar_char] for cigar_int, cigar_char in re.findall(r"(\d+)(\D)", row[3])]
+                genomic_dict = translate.generate_genomic_dict(int(row[2]), cigar_arr, row[4:] == ["-"])
+                block_index = translate.map_coordinates(alignments_of([row]))[row[0]].loci[0][1]
+                for _ in range(20):
+                    tr_start = rng.randint(0, 80)
+                    tr_end = rng.randint(tr_start, 90)
+                    self.assertEqual(block_index.get_range(tr_start, tr_end),
+                                     translate.map_transcript_range(genomic_dict, tr_start, tr_end),
+                                     (row, tr_start, tr_end))
+
+    def test_engines_keep_point_and_range_queries_in_order(self):
+        query_text = "TR1\t0\t30\nTR1\t4\nTRM\t3\t7\nTR9\t0\t5\nTR1\t8\t8\nTR1\t14\t16\nTRM\t0\n"
+        expected = ("TR1\t0\t8\tCHR1\t3\t11\nTR1\t8\t14\tCHR1\t18\t24\nTR1\t16\t18\tCHR1\t24\t26\n"
+                    "TR1\t18\t25\tCHR1\t37\t44\nTR1\t4\tCHR1\t7\nTRM\t3\t5\tCHR2\t115\t117\n"
+                    "TRM\t5\t7\tCHR2\t103\t105\nTRM\t0\tCHR2\t119\n",
+                    [(translate.MISS_UNKNOWN_TRANSCRIPT, "TR9", "0-5"),
+                     (translate.MISS_UNMAPPED_COORDINATE, "TR1", "8-8"),
+                     (translate.MISS_UNMAPPED_COORDINATE, "TR1", "14-16")])
+        engines = [engine for engine in translate.ENGINES if engine != "numpy" or translate.np is not None]
+        for engine in engines:
+            self.assertEqual(translate_queries(engine, self.coord_map, query_text), expected, engine)
+
+
+class SortedMergeCoordMapTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Function that returns the messages printed while the queries are looked up in the mapping text
+    def lookup_messages(self, mapping_text, queries):
+        mapping_file = os.path.join(self.directory, "mapping.txt")
+        with open(mapping_file, "w") as mapping:
+            mapping.write(mapping_text)
+        coord_map = translate.SortedMergeCoordMap(mapping_file)
+        messages = io.StringIO()
+        with self.assertRaises(SystemExit), redirect_stdout(messages):
+            for tr in queries:
+                tr in coord_map
+        coord_map.close()
+        return messages.getvalue()
+
+    def test_unsorted_genome_mapping_file(self):
+        self.assertEqual(self.lookup_messages("TR2\tCHR1\t3\t8M\nTR1\tCHR1\t3\t8M\n", ["TR3"]),
+                         "Error! Genome mapping file is not sorted by transcript id\n")
+
+    def test_unsorted_transcript_processing_file(self):
+        self.assertEqual(self.lookup_messages("TR1\tCHR1\t3\t8M\nTR2\tCHR1\t3\t8M\n", ["TR2", "TR1"]),
+                         "Error! Transcript processing file is not sorted by transcript id\n")
+
+
+class CachedCoordMapTest(unittest.TestCase):
+    def test_eviction_frees_compiled_blocks(self):
+        coord_map = translate.CachedCoordMap(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M"),
+                                                            ("TR2", "CHR2", 10, "20M")]), max_entries=1)
+        tr_starts = coord_map["TR1"].loci[0][1].tr_starts
+        coord_map["TR2"]
+        self.assertEqual(coord_map.evictions, 1)
+        # only the local name and the getrefcount argument still refer to the evicted blocks
+        self.assertEqual(sys.getrefcount(tr_starts), 2)
+
+
+class MappedCoordMapTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.directory, "mapping.idx")
+        translate.build_index_file(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M"), ("TR2", "CHR2", 10, "20M")]),
+                                   self.index_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup_is_memoized(self):
+        coord_map = translate.MappedCoordMap(self.index_path)
+        self.assertIn("TR1", coord_map)
+        self.assertIs(coord_map["TR1"], coord_map.compiled["TR1"])
+        self.assertNotIn("TR3", coord_map)
+        self.assertRaises(KeyError, coord_map.__getitem__, "TR3")
+
+    def test_memo_is_bounded(self):
+        coord_map = translate.MappedCoordMap(self.index_path)
+        with mock.patch.object(translate, "INDEX_MEMO_SIZE", 1):
+            self.assertEqual(coord_map["TR1"].lookup(4), [("CHR1", 7)])
+            self.assertEqual(coord_map["TR2"].lookup(0), [("CHR2", 10)])
+            self.assertEqual(list(coord_map.compiled), ["TR2"])
+            self.assertEqual(coord_map["TR1"].lookup(4), [("CHR1", 7)])
+            self.assertEqual(list(coord_map.compiled), ["TR1"])
+
+    def test_truncated_index_is_rejected(self):
+        with open(self.index_path, "rb") as index_file:
+            data = index_file.read()
+        with open(self.index_path, "wb") as index_file:
+            index_file.write(data[:len(data) - 12])
+        messages = io.StringIO()
+        with self.assertRaises(SystemExit), redirect_stdout(messages):
+            translate.MappedCoordMap(self.index_path)
+        self.assertEqual(messages.getvalue(), "Error! Index file format is invalid\n")
+
+
+@unittest.skipIf(translate.sqlite3 is None, "requires the sqlite3 module")
+class SqliteCoordMapTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store_path_with_uri_characters(self):
+        mapping_file = os.path.join(self.directory, "mapping.txt")
+        with open(mapping_file, "w") as mapping:
+            mapping.write("TR1\tCHR1\t3\t8M7D6M2I2M11D7M\n")
+        store_path = os.path.join(self.directory, "a#b?c%d.sqlite")
+        translate.build_sqlite_store(mapping_file, store_path)
+
+        coord_map = translate.SqliteCoordMap(store_path)
+        self.assertEqual(coord_map["TR1"].lookup(4), [("CHR1", 7)])
+        # the store is opened read-only in place, without creating a file at the path before the "#"
+        self.assertEqual(sorted(os.listdir(self.directory)), ["a#b?c%d.sqlite", "mapping.txt"])
+
+
+class RunStatsTest(unittest.TestCase):
+    def test_stage_cpu_time_includes_child_processes(self):
+        stats = translate.RunStats()
+        with stats.stage("query"):
+            subprocess.run([sys.executable, "-c", "import time\nend = time.process_time() + 0.3\n"
+                                                  "while time.process_time() < end: pass"], check=True)
+        self.assertGreaterEqual(stats.stages["query"]["cpu_seconds"], 0.25)
+
+    def test_queries_answered_counts_queries_not_output_rows(self):
+        coord_map = translate.map_coordinates(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M"),
+                                                             ("TR1", "CHR2", 10, "30M")], all_loci=True))
+        stats_path = os.path.join(tempfile.mkdtemp(), "stats.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(stats_path))
+        stats = translate.RunStats()
+        query_lines, write, report = stats.instrument(
+            translate.query_lines_from_bytes(b"TR1\t4\nTR1\t0\t30\nTR9\t1\nTR1\t100\n", "python"), [].append,
+            lambda reason, tr_id, tr_coord: None)
+        translate.get_query_translator("python")(query_lines, coord_map, write, report)
+        stats.write_json(stats_path)
+        with open(stats_path) as stats_file:
+            counters = json.load(stats_file)["counters"]
+        # the point query is answered on both loci and the range query with four pieces on CHR1 and one on CHR2
+        self.assertEqual((counters["queries"], counters["queries_answered"], counters["output_rows"]), (4, 2, 7))
+        self.assertEqual((counters["unknown_transcript_misses"], counters["unmapped_coordinate_misses"]), (1, 1))
+
+
+# Function that returns seeded random genome mapping rows: plus, minus and unstranded alignments of cigar strings
+# with every op, and transcripts with several rows
+def random_mapping_rows(seed, transcripts=40):
+    rng = random.Random(seed)
+    rows = []
+    for tr_num in range(transcripts):
+        for _ in range(rng.choice((1, 1, 2, 3))):
+            cigar = "".join(str(rng.randint(1, 12)) + rng.choice("MMMMDNIS=X") for _ in range(rng.randint(1, 6)))
+            row = ["TR" + str(tr_num), "CHR" + str(rng.randint(1, 3)), str(rng.randint(0, 1000)), cigar + "1M"]
+            strand = rng.choice(("", "+", "-", "-"))
+            rows.append(row + [strand] if strand else row)
+    rng.shuffle(rows)
+    return rows
+
+
+# Function that returns the (chr, per-base dict of "generate_genomic_dict") loci of each transcript of the rows
+def per_base_loci(rows, all_loci):
+    genomic_dicts = {}
+    for row in rows:
+        cigar_arr = [[int(cigar_int), cigar_char] for cigar_int, cigar_char in re.findall(r"(\d+)(\D)", row[3])]
+        locus = (row[1], translate.generate_genomic_dict(int(row[2]), cigar_arr, row[4:] == ["-"]))
+        if all_loci and row[0] in genomic_dicts:
+            genomic_dicts[row[0]].append(locus)
+        else:
+            genomic_dicts[row[0]] = [locus]
+    return genomic_dicts
+
+
+# Function that returns the expected output and misses of point queries, using the per-base dicts of
+# "generate_genomic_dict" as the reference
+def expected_translation(rows, queries, all_loci):
+    genomic_dicts = per_base_loci(rows, all_loci)
+    output = []
+    misses = []
+    for tr_id, tr_coord in queries:
+        if tr_id not in genomic_dicts:
+            misses.append((translate.MISS_UNKNOWN_TRANSCRIPT, tr_id, str(tr_coord)))
+            continue
+        matches = [(ch, genomic_dict[tr_coord]) for ch, genomic_dict in genomic_dicts[tr_id] if tr_coord in genomic_dict]
+        if not matches:
+            misses.append((translate.MISS_UNMAPPED_COORDINATE, tr_id, str(tr_coord)))
+        output.extend(tr_id + "\t" + str(tr_coord) + "\t" + ch + "\t" + str(genomic_coord) + "\n"
+                      for ch, genomic_coord in matches)
+    return "".join(output), misses
+
+
+class DifferentialTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Function that returns the coordinate maps of every kind built from the rows
+    def coord_maps(self, rows, all_loci):
+        mapping_file = os.path.join(self.directory, "mapping.txt")
+        with open(mapping_file, "w") as mapping:
+            mapping.writelines("\t".join(row) + "\n" for row in rows)
+        alignments = alignments_of(rows, all_loci)
+        index_path = os.path.join(self.directory, "mapping" + str(all_loci) + ".idx")
+        translate.build_index_file(alignments, index_path)
+        coord_maps = {"block": translate.map_coordinates(alignments),
+                      "lazy": translate.LazyCoordMap(alignments),
+                      "cache": translate.CachedCoordMap(alignments, max_entries=3),
+                      "per-base cache": translate.CachedCoordMap(alignments, max_entries=3, per_base=True),
+                      "index": translate.MappedCoordMap(index_path)}
+        if translate.sqlite3 is not None:
+            store_path = os.path.join(self.directory, "mapping" + str(all_loci) + ".sqlite")
+            translate.build_sqlite_store(mapping_file, store_path, all_loci=all_loci)
+            coord_maps["store"] = translate.SqliteCoordMap(store_path, cache_size=3)
+        return coord_maps
+
+    def test_engines_and_coord_maps_match_generate_genomic_dict(self):
+        engines = [engine for engine in translate.ENGINES if engine != "numpy" or translate.np is not None]
+        for seed in range(3):
+            rows = random_mapping_rows(seed)
+            rng = random.Random(seed)
+            queries = [("TR" + str(rng.randint(0, 44)), rng.randint(0, 80)) for _ in range(2000)]
+            query_text = "".join(tr_id + "\t" + str(tr_coord) + "\n" for tr_id, tr_coord in queries)
+            for all_loci in (False, True):
+                expected = expected_translation(rows, queries, all_loci)
+                self.assertTrue(expected[0])
+                for name, coord_map in self.coord_maps(rows, all_loci).items():
+                    for engine in engines:
+                        # as on the command line, per-base transcript maps are not used with the numpy engine
+                        if name == "per-base cache" and engine == "numpy":
+                            continue
+                        self.assertEqual(translate_queries(engine, coord_map, query_text), expected,
+                                         (seed, all_loci, name, engine))
+
+    def test_sorted_merge_matches_generate_genomic_dict(self):
+        # a stable sort keeps the rows of a transcript in genome mapping file order; the numpy engine is not used
+        # with sorted inputs, as on the command line
+        engines = [engine for engine in translate.ENGINES if engine != "numpy"]
+        mapping_file = os.path.join(self.directory, "mapping.txt")
+        for seed in range(3):
+            rows = sorted(random_mapping_rows(seed), key=lambda row: row[0])
+            with open(mapping_file, "w") as mapping:
+                mapping.writelines("\t".join(row) + "\n" for row in rows)
+            rng = random.Random(seed)
+            queries = sorted([("TR" + str(rng.randint(0, 44)), rng.randint(0, 80)) for _ in range(2000)],
+                             key=lambda query: query[0])
+            query_text = "".join(tr_id + "\t" + str(tr_coord) + "\n" for tr_id, tr_coord in queries)
+            for all_loci in (False, True):
+                expected = expected_translation(rows, queries, all_loci)
+                for engine in engines:
+                    coord_map = translate.SortedMergeCoordMap(mapping_file, all_loci)
+                    self.assertEqual(translate_queries(engine, coord_map, query_text), expected,
+                                     (seed, all_loci, engine))
+                    coord_map.close()
+
+
+class ReverseTest(unittest.TestCase):
+    def test_matches_inverted_generate_genomic_dict(self):
+        for seed in range(3):
+            rows = random_mapping_rows(seed)
+            rng = random.Random(seed)
+            queries = [("CHR" + str(rng.randint(0, 3)), rng.randint(0, 1100)) for _ in range(2000)]
+            for all_loci in (False, True):
+                # the per-base dicts inverted into (transcript, transcript coordinate) lists keyed by chr and position
+                inverted = {}
+                for tr, loci in per_base_loci(rows, all_loci).items():
+                    for ch, genomic_dict in loci:
+                        chr_positions = inverted.setdefault(ch, {})
+                        for tr_coord, genomic_coord in genomic_dict.items():
+                            chr_positions.setdefault(genomic_coord, []).append((tr, tr_coord))
+                expected_output = []
+                expected_misses = []
+                for ch, chr_coord in queries:
+                    if ch not in inverted:
+                        expected_misses.append((translate.MISS_UNKNOWN_CHROMOSOME, ch, str(chr_coord)))
+                    elif chr_coord not in inverted[ch]:
+                        expected_misses.append((translate.MISS_UNCOVERED_COORDINATE, ch, str(chr_coord)))
+                    expected_output.extend(ch + "\t" + str(chr_coord) + "\t" + tr + "\t" + str(tr_coord) + "\n"
+                                           for tr, tr_coord in inverted.get(ch, {}).get(chr_coord, []))
+
+                output = []
+                misses = []
+                translate.reverse_query_lines(
+                    io.StringIO("".join(ch + "\t" + str(chr_coord) + "\n" for ch, chr_coord in queries)),
+                    translate.build_genomic_block_index(alignments_of(rows, all_loci)), output.append,
+                    lambda reason, ch, chr_coord: misses.append((reason, ch, chr_coord)))
+                self.assertTrue(expected_output)
+                self.assertEqual(("".join(output), misses), ("".join(expected_output), expected_misses),
+                                 (seed, all_loci))
+
+    def test_rows_and_misses_before_a_malformed_line_are_written(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        query_file = os.path.join(directory, "queries.txt")
+        output_file = os.path.join(directory, "output.txt")
+        with open(query_file, "w") as queries:
+            queries.write("CHR1\t7\nCHR9\t1\nCHR1\t0\nCHR1\tx\n")
+        genomic_index = translate.build_genomic_block_index(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M")]))
+        messages = io.StringIO()
+        with self.assertRaises(SystemExit), redirect_stdout(messages):
+            translate.reverse_merge_genomic_file(query_file, genomic_index, output_file)
+        with open(output_file) as output:
+            self.assertEqual(output.read(), "CHR1\t7\tTR1\t4\n")
+        self.assertEqual(messages.getvalue(),
+                         "Chromosome CHR9 does not exist in genome mapping file\n"
+                         "Genomic coordinate 0 on chromosome CHR1 is not covered by any transcript\n"
+                         "Error! Genomic coordinates must be integers\n")
+
+
+class BgzfTest(unittest.TestCase):
+    def test_block_structure(self):
+        rng = random.Random(0)
+        data = "".join("TR%d\t%d\tCHR1\t%d\n" % (rng.randint(0, 999), rng.randint(0, 9999), rng.randint(0, 99999))
+                       for _ in range(20000)).encode("utf-8")
+        compressed = io.BytesIO()
+        writer = translate.BgzfWriter(compressed, owns_file=False)
+        for start in range(0, len(data), 10000):
+            writer.write(data[start:start + 10000])
+        writer.close()
+        compressed = compressed.getvalue()
+
+        # every block is a gzip member with a BC extra subfield holding its size - 1, and the file ends with the
+        # empty end-of-file block
+        self.assertTrue(compressed.endswith(translate.BGZF_EOF))
+        blocks = []
+        position = 0
+        while position < len(compressed):
+            header = translate.BGZF_HEADER.unpack_from(compressed, position)
+            self.assertEqual(header[:4] + header[5:11], (31, 139, 8, 4, 0, 255, 6, 66, 67, 2))
+            block = compressed[position:position + header[11] + 1]
+            inflated = zlib.decompress(block[translate.BGZF_HEADER.size:-8], -15)
+            self.assertEqual(struct.unpack("<II", block[-8:]), (zlib.crc32(inflated), len(inflated)))
+            self.assertLessEqual(len(inflated), translate.BGZF_BLOCK_SIZE)
+            blocks.append(inflated)
+            position += len(block)
+        self.assertEqual(position, len(compressed))
+        self.assertEqual(blocks[-1], b"")
+        self.assertGreater(len(blocks), 2)
+        self.assertEqual(b"".join(blocks), data)
+        self.assertEqual(gzip.decompress(compressed), data)
+
+
+class MergeTranscriptFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rows_and_misses_before_a_malformed_line_are_written(self):
+        coord_map = translate.map_coordinates(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M")]))
+        query_file = os.path.join(self.directory, "queries.txt")
+        with open(query_file, "w") as queries:
+            queries.write("TR1\t4\nTR9\t1\nTR2\tx\n")
+        engines = [engine for engine in translate.ENGINES if engine != "numpy" or translate.np is not None]
+        for engine in engines:
+            for output_name, opener in (("output.txt", open), ("output.txt.gz", gzip.open)):
+                output = os.path.join(self.directory, output_name)
+                messages = io.StringIO()
+                with self.assertRaises(SystemExit), redirect_stdout(messages):
+                    translate.merge_transcript_file(query_file, coord_map, output, engine)
+                with opener(output, "rt") as output_file:
+                    self.assertEqual(output_file.read(), "TR1\t4\tCHR1\t7\n", (engine, output_name))
+                self.assertEqual(messages.getvalue(), "Transcript TR9 does not exist in genome mapping file\n"
+                                                      "Error! Transcript coordinates must be integers\n")
+
+    def test_worker_messages_follow_the_misses_of_earlier_chunks(self):
+        coord_map = translate.map_coordinates(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M")]))
+        query_file = os.path.join(self.directory, "queries.txt")
+        with open(query_file, "w") as queries:
+            queries.write("TR9\t1\n" + "TR1\t4\n" * 100 + "TR9\t2\nTR2\tx\n" + "TR1\t4\n" * 100)
+        output = os.path.join(self.directory, "output.txt")
+        messages = io.StringIO()
+        with self.assertRaises(SystemExit), redirect_stdout(messages):
+            translate.merge_transcript_file_parallel(query_file, coord_map, output, 2, chunk_size=64)
+        self.assertEqual(messages.getvalue(), "Transcript TR9 does not exist in genome mapping file\n"
+                                              "Transcript TR9 does not exist in genome mapping file\n"
+                                              "Error! Transcript coordinates must be integers\n")
+        with open(output) as output_file:
+            self.assertEqual(output_file.read(), "TR1\t4\tCHR1\t7\n" * 100)
+
+
+class GtfReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Function that reads the GTF/GFF3 text and returns the compiled coordinate map of its transcripts
+    def read(self, text, all_loci=False):
+        exon_file = os.path.join(self.directory, "exons.gff3")
+        with open(exon_file, "w") as exons:
+            exons.write(text)
+        return translate.map_coordinates(translate.read_exon_structure_file(exon_file, None, None, all_loci))
+
+    def test_gff3_parent_lists_and_transcript_prefix(self):
+        coord_map = self.read("##gff-version 3\n"
+                              "chr1\tsrc\tmRNA\t11\t40\t.\t+\t.\tID=transcript:T1\n"
+                              "chr1\tsrc\texon\t11\t20\t.\t+\t.\tParent=transcript:T1,transcript:T2\n"
+                              "chr1\tsrc\texon\t31\t40\t.\t+\t.\tParent=transcript:T1\n")
+        self.assertEqual(sorted(coord_map), ["T1", "T2"])
+        self.assertEqual([coord_map["T1"].lookup(tr_coord) for tr_coord in (0, 9, 10, 19, 20)],
+                         [[("chr1", 10)], [("chr1", 19)], [("chr1", 30)], [("chr1", 39)], []])
+        self.assertEqual([coord_map["T2"].lookup(tr_coord) for tr_coord in (0, 9, 10)],
+                         [[("chr1", 10)], [("chr1", 19)], []])
+
+    def test_minus_strand_exons_in_any_order(self):
+        # minus strand transcripts are read from their 3' end, whatever the order of their exon lines
+        for exon_lines in ((0, 1), (1, 0)):
+            lines = ['chr2\tsrc\texon\t11\t20\t.\t-\t.\tgene_id "G1"; transcript_id "M1";\n',
+                     'chr2\tsrc\texon\t51\t60\t.\t-\t.\tgene_id "G1"; transcript_id "M1";\n']
+            coord_map = self.read("".join(lines[i] for i in exon_lines))
+            self.assertEqual([coord_map["M1"].lookup(tr_coord) for tr_coord in (0, 9, 10, 19, 20)],
+                             [[("chr2", 59)], [("chr2", 50)], [("chr2", 19)], [("chr2", 10)], []], exon_lines)
+
+    def test_overlapping_exons(self):
+        messages = io.StringIO()
+        with self.assertRaises(SystemExit), redirect_stdout(messages):
+            self.read('chr1\tsrc\texon\t11\t20\t.\t+\t.\ttranscript_id "T1";\n'
+                      'chr1\tsrc\texon\t20\t30\t.\t+\t.\ttranscript_id "T1";\n')
+        self.assertEqual(messages.getvalue(), "Error! Exons of transcript T1 overlap\n")
+
+    def test_exons_on_two_chromosomes(self):
+        text = ('chr1\tsrc\texon\t11\t20\t.\t+\t.\ttranscript_id "T1";\n'
+                'chrX\tsrc\texon\t101\t110\t.\t+\t.\ttranscript_id "T1";\n'
+                'chr1\tsrc\texon\t31\t40\t.\t+\t.\ttranscript_id "T1";\n')
+        # each chromosome is a locus of its own; only the one whose first exon comes last is kept by default
+        self.assertEqual(self.read(text)["T1"].lookup(0), [("chrX", 100)])
+        coord_map = self.read(text, all_loci=True)
+        self.assertEqual([coord_map["T1"].lookup(tr_coord) for tr_coord in (0, 10, 19)],
+                         [[("chr1", 10), ("chrX", 100)], [("chr1", 30)], [("chr1", 39)]])
+
+
+class LiftoverTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.coord_map = translate.map_coordinates(alignments_of([("TR1", "CHR1", 3, "8M7D6M2I2M11D7M"),
+                                                                  ("TRM", "CHR2", 100, "5M10N5M", "-")]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Function that lifts over the text of a file in file_format and returns the output text
+    def liftover(self, text, file_format):
+        input_file = os.path.join(self.directory, "input." + file_format)
+        output = os.path.join(self.directory, "output." + file_format)
+        with open(input_file, "w") as intervals:
+            intervals.write(text)
+        translate.liftover_file(input_file, self.coord_map, output, file_format)
+        with open(output) as lifted:
+            return lifted.read()
+
+    def test_gtf_frames_of_split_features(self):
+        # the frame of each piece counts from the transcript start of the piece, also on the minus strand, where
+        # the pieces are written in transcript order and the strand is flipped
+        self.assertEqual(self.liftover('##gff-version 2\n'
+                                       'TR1\tsrc\tCDS\t3\t20\t.\t+\t0\tgene_id "g1";\n'
+                                       'TRM\tsrc\tCDS\t2\t9\t.\t+\t1\tgene_id "g2";\n', "gtf"),
+                         '##gff-version 2\n'
+                         'CHR1\tsrc\tCDS\t6\t11\t.\t+\t0\tgene_id "g1";\n'
+                         'CHR1\tsrc\tCDS\t19\t24\t.\t+\t0\tgene_id "g1";\n'
+                         'CHR1\tsrc\tCDS\t25\t26\t.\t+\t1\tgene_id "g1";\n'
+                         'CHR1\tsrc\tCDS\t38\t39\t.\t+\t2\tgene_id "g1";\n'
+                         'CHR2\tsrc\tCDS\t116\t119\t.\t-\t1\tgene_id "g2";\n'
+                         'CHR2\tsrc\tCDS\t102\t105\t.\t-\t0\tgene_id "g2";\n')
+
+    def test_bed_columns_and_headers(self):
+        # headers and blank lines are copied, BED rows keep their name, score and strand (the BED12 block columns
+        # are dropped), and the strand is flipped on the minus strand
+        self.assertEqual(self.liftover("track name=x\nbrowser position CHR1:1-100\n#c\n\n"
+                                       "TR1\t0\t10\tn1\t7\t+\t0\t10\t0\t1\t10,\t0,\n"
+                                       "TRM\t0\t10\tn2\t0\t+\nTR1\t2\t5\n", "bed"),
+                         "track name=x\nbrowser position CHR1:1-100\n#c\n\n"
+                         "CHR1\t3\t11\tn1\t7\t+\nCHR1\t18\t20\tn1\t7\t+\n"
+                         "CHR2\t115\t120\tn2\t0\t-\nCHR2\t100\t105\tn2\t0\t-\nCHR1\t5\t8\n")
+
+    def test_rows_before_a_malformed_line_are_written(self):
+        messages = io.StringIO()
+        with self.assertRaises(SystemExit), redirect_stdout(messages):
+            self.liftover("TR1\t2\t5\nTR1\tx\t3\n", "bed")
+        self.assertEqual(messages.getvalue(), "Error! Interval coordinates must be integers\n")
+        with open(os.path.join(self.directory, "output.bed")) as lifted:
+            self.assertEqual(lifted.read(), "CHR1\t5\t8\n")
+
+
+class ServeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, "translate.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Function that sends the query data to the daemon and returns whether the query exited, its output and messages
+    def query(self, data):
+        query_file = os.path.join(self.directory, "queries.txt")
+        output = os.path.join(self.directory, "output.txt")
+        with open(query_file, "wb") as queries:
+            queries.write(data)
+        messages = io.StringIO()
+        exited = False
+        with redirect_stdout(messages):
+            try:
+                translate.query_server(self.socket_path, query_file, output)
+            except SystemExit:
+                exited = True
+        with open(output) as output_file:
+            return exited, output_file.read(), messages.getvalue()
+
+    def test_query_round_trip(self):
+        server = subprocess.Popen([sys.executable, translate.__file__, "serve", "--genome-mapping-file",
+                                   os.path.join(os.path.dirname(translate.__file__), "input_file1.txt"),
+                                   "--socket", self.socket_path])
+        try:
+            deadline = time.time() + 30
+            while not os.path.exists(self.socket_path) and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(self.query(b"TR1\t4\nTR9\t1\nTR2\t0\n"),
+                             (False, "TR1\t4\tCHR1\t7\nTR2\t0\tCHR2\t10\n",
+                              "Transcript TR9 does not exist in genome mapping file\n"))
+            # a format error and a file that is not UTF-8 stop the batch with a message, not a dropped connection
+            self.assertEqual(self.query(b"TR1\t4\nTR2\tx\n"),
+                             (True, "TR1\t4\tCHR1\t7\n", "Error! Transcript coordinates must be integers\n"))
+            exited, output_text, messages = self.query(b"TR1\t4\n\xff\t1\n")
+            self.assertTrue(exited)
+            self.assertTrue(messages.startswith("Error! 'utf-8' codec can't decode"), messages)
+            # the daemon keeps serving after a failed batch
+            self.assertEqual(self.query(b"TR2\t0\n"), (False, "TR2\t0\tCHR2\t10\n", ""))
+        finally:
+            server.terminate()
+            server.wait()
+
+    def test_file_that_is_not_a_socket_is_kept(self):
+        with open(self.socket_path, "w") as data_file:
+            data_file.write("data\n")
+        messages = io.StringIO()
+        with self.assertRaises(SystemExit), redirect_stdout(messages):
+            translate.serve_coord_map({}, self.socket_path)
+        self.assertEqual(messages.getvalue(), "Error! " + self.socket_path + " exists and is not a socket\n")
+        with open(self.socket_path) as data_file:
+            self.assertEqual(data_file.read(), "data\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,9 @@ Input args:
 --input_file1: file path
 A four column (tab-separated) file containing the transcripts. The first column is the transcript
 name, and the remaining three columns indicate it’s genomic mapping: chromosome name,
-0-based starting position on the chromosome, and CIGAR string indicating the mapping.
+0-based starting position on the chromosome, and CIGAR string indicating the mapping. An optional fifth column
+gives the strand (+ or -); the position and CIGAR string of a minus strand transcript are given on the plus strand.
+The transcripts can also be read from the exon records of a GTF or GFF3 file.
 
 --input_file2: file path
 A two column (tab-separated) file indicating a set of queries. The first column is a transcript
@@ -18,46 +20,344 @@ name, and the second column is a 0-based transcript coordinate.
 @Date: 5/27/2021
 """
 
+import bz2
+import gc
+import gzip
+import io
+import json
+import lzma
+import mmap
+import multiprocessing
 import os
+import socket
+import socketserver
+import stat
+import struct
 import sys
 import re
+import time
+import zlib
 from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import chain, islice
+from operator import attrgetter
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+ENGINES = ("python", "bytes", "numpy")
+# Number of query lines translated together by the numpy engine, and the regular expression matching a batch of
+# them that holds only well-formed point queries (transcript id, whitespace, ASCII digits and trailing whitespace)
+NUMPY_BATCH_LINES = 1 << 16
+NUMPY_POINT_QUERIES = re.compile(r"(?:\S+[^\S\n]+[0-9]+[^\S\n]*\n)*")
+# Largest transcript coordinate searched by the numpy engine: larger coordinates (including those that do not fit in
+# int64) are past the end of every transcript, and are clamped to it so that they are reported as unmapped
+NUMPY_MAX_COORDINATE = 2 ** 62
+
+# Reasons a query produces no output row
+MISS_UNKNOWN_TRANSCRIPT = "UNKNOWN_TRANSCRIPT"
+MISS_UNMAPPED_COORDINATE = "UNMAPPED_COORDINATE"
+# Reasons a genomic query of the "reverse" command produces no output row
+MISS_UNKNOWN_CHROMOSOME = "UNKNOWN_CHROMOSOME"
+MISS_UNCOVERED_COORDINATE = "UNCOVERED_COORDINATE"
+
+# CIGAR operations in the order of their BAM op codes; a packed CIGAR op is length << 4 | op code
+CIGAR_OPS = "MIDNSHP=X"
+ALIGNED_CIGAR_OPS = frozenset(CIGAR_OPS.index(op) for op in "M=X")
+REFERENCE_CIGAR_OPS = frozenset(CIGAR_OPS.index(op) for op in "DN")
+QUERY_CIGAR_OPS = frozenset(CIGAR_OPS.index(op) for op in "IS")
+CIGAR_TOKEN = re.compile(r'(\d+)([MIDNSHP=X])', re.I)
+# Op codes of the exons and introns of a GTF/GFF3 transcript
+EXON_OP = CIGAR_OPS.index("M")
+INTRON_OP = CIGAR_OPS.index("N")
+
+# Formats of the genome mapping file: rows of transcript, chr, start coordinate, cigar string (and strand), or the
+# exon records of a GTF/GFF3 file. In GTF/GFF3 exon lines, the transcript id is the transcript_id attribute or else
+# the GFF3 Parent attribute (which may list several transcripts)
+MAPPING_FORMATS = ("cigar", "gtf")
+TRANSCRIPT_ID_ATTRIBUTE = re.compile(r'(?:^|;)\s*transcript_id[ =]"?([^";\r\n]+)')
+PARENT_ATTRIBUTE = re.compile(r'(?:^|;)\s*Parent=([^;\r\n]+)')
+
+# Strand of a feature lifted over to a minus strand alignment
+FLIPPED_STRANDS = {"+": "-", "-": "+"}
+
+# Parsed cigar arrays and compiled cigar blocks, cached by cigar so that repeated cigars are processed only once
+# Each cache is cleared when it reaches CIGAR_CACHE_SIZE entries. The caches hold on to everything they return, so
+# coordinate maps that must run in bounded memory ("SortedMergeCoordMap", "CachedCoordMap") bypass them
+CIGAR_CACHE_SIZE = 65536
+_parsed_cigars = {}
+_compiled_cigar_blocks = {}
+
+# Compiled index file layout: magic, header (byte order mark, number of transcript-chr mappings, chromosomes and
+# blocks), followed by 8-byte aligned sections of native int64 arrays and utf-8 name blobs
+INDEX_MAGIC = b"TGCIDX02"
+INDEX_HEADER = struct.Struct("=qqqq")
+# Number of recently used transcripts kept compiled by "MappedCoordMap"; the rest stay in the shared page cache only
+INDEX_MEMO_SIZE = 16384
+
+# Frames exchanged with the "serve" daemon are prefixed with their length
+FRAME_HEADER = struct.Struct("!Q")
+
+# Schema of the SQLite alignment store written by "build_sqlite_store". Each genome mapping row is numbered by its
+# line; as in "create_transcript_genomic_dict", only the last row of a transcript is kept unless all loci are stored
+# The blocks of minus strand rows (reverse = 1) are stored in transcript order, as compiled by "compile_cigar_blocks"
+STORE_SCHEMA_VERSION = 3
+STORE_SCHEMA = """
+CREATE TABLE chromosomes (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE transcripts (tr_id TEXT NOT NULL, row INTEGER NOT NULL, chrom_id INTEGER NOT NULL,
+                          chr_start INTEGER NOT NULL, reverse INTEGER NOT NULL, PRIMARY KEY (tr_id, row))
+                          WITHOUT ROWID;
+CREATE TABLE blocks (row INTEGER NOT NULL, tr_start INTEGER NOT NULL, chr_offset INTEGER NOT NULL,
+                     length INTEGER NOT NULL);
+"""
+# Number of transcripts cached by "SqliteCoordMap", number of transcript ids per set-based lookup (below the SQLite
+# limit on query parameters) and number of query lines whose transcripts are looked up together
+STORE_CACHE_SIZE = 65536
+STORE_LOOKUP_SIZE = 500
+PREFETCH_LINES = 4096
+
+# Size in bytes of the output batches written by "BatchWriter"
+DEFAULT_WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Openers of compressed files by filename extension
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# BGZF block header (a gzip member header with a BC extra subfield holding the block size - 1), the largest amount
+# of data in one block and the empty block that ends a BGZF file
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
 
 
 # Function for reading in the genomic mapping file (input_file1).
-# Create a dictionary which stores the chr, start coordinate, and cigar string for each transcript-chr mapping
-def create_transcript_genomic_dict(genome_mapping_file):
+# Create a dictionary which stores a list of TranscriptAlignments (chr, start coordinate and packed cigar) for each
+# transcript: the last row of the transcript, or with all_loci=True every row of the transcript in file order
+# If a set of transcript ids is given, only rows for those transcripts are parsed; other rows are skipped
+# after a cheap check of their first field. If a RunStats is given, the parsed rows and cigar ops are counted in it
+# mapping_format is "cigar" or "gtf" (see "create_exon_structure_dict"); by default it is chosen by the file name
+def create_transcript_genomic_dict(genome_mapping_file, transcript_ids=None, stats=None, all_loci=False,
+                                   mapping_format=None):
+    if (mapping_format or detect_mapping_format(genome_mapping_file)) == "gtf":
+        return create_exon_structure_dict(genome_mapping_file, transcript_ids, stats, all_loci)
+
     transcript_to_genomic_dict = {}
-    genome_map = open(genome_mapping_file, "r")
+    genome_map = open_file(genome_mapping_file, "r")
     for row in genome_map:
+        if transcript_ids is not None:
+            first_field = row.split(None, 1)
+            if not first_field or first_field[0] not in transcript_ids:
+                continue
+
         row = row.rstrip()
         rows = re.split(r'\s+', row)
+        alignment = add_genome_mapping_row(transcript_to_genomic_dict, rows, all_loci)
+        if stats is not None:
+            stats.count("rows_parsed")
+            stats.count("cigar_ops", len(alignment.cigar))
 
-        # check input genome_map format
-        check_genome_map_line_format(rows)
+    genome_map.close()
+    return transcript_to_genomic_dict
 
-        transcript_id = rows[0]
-        chr_num = rows[1]
-        start_coord = rows[2]
-        cigar = rows[3]
 
-        transcript_to_genomic_dict[transcript_id] = {}
-        transcript_to_genomic_dict[transcript_id][chr_num] = {}
-        transcript_to_genomic_dict[transcript_id][chr_num]["start_coord"] = int(start_coord)
-        transcript_to_genomic_dict[transcript_id][chr_num]["cigar"] = process_cigar_string(cigar)
+# Function that returns the format of a genome mapping file ("cigar" or "gtf"), judging by its extension
+def detect_mapping_format(filename):
+    if detect_liftover_format(filename) == "gtf":
+        return "gtf"
+    return "cigar"
 
-    genome_map.close()
+
+# Function for reading in a genome mapping file of GTF or GFF3 exon records instead of cigar strings
+# The exons are grouped by transcript id and the exons of each transcript, sorted by their start, are packed straight
+# into the cigar op array of its TranscriptAlignment (exons as M ops and the introns between them as N ops), so every
+# engine compiles them like a cigar, without a cigar string being written or parsed. Minus strand transcripts are
+# reversed, as with the strand column of a cigar file. Lines of other features are skipped
+# transcript_ids and stats are used as in "create_transcript_genomic_dict". A transcript with exons on several
+# chromosomes or strands has one locus for each, of which only the last to appear is kept unless all_loci is True
+def create_exon_structure_dict(exon_file, transcript_ids=None, stats=None, all_loci=False):
+    with paused_gc():
+        return read_exon_structure_file(exon_file, transcript_ids, stats, all_loci)
+
+
+# Function that does the work of "create_exon_structure_dict"
+def read_exon_structure_file(exon_file, transcript_ids, stats, all_loci):
+    # exons of every (transcript id, chr, minus strand) locus, in order of the first exon of each locus
+    locus_exons = {}
+    rows_parsed = 0
+    gtf_file = open_file(exon_file, "r")
+    for line in gtf_file:
+        # lines of other features, comments and headers are skipped before they are split
+        if "\texon\t" not in line:
+            continue
+        fields = line.split("\t")
+        if len(fields) > 2 and fields[2] != "exon":
+            continue
+
+        # check format (in full only for the lines failing the quick checks, to report why)
+        if len(fields) != 9 or not (fields[3].isdigit() and fields[4].isdigit()) or \
+                not 0 < int(fields[3]) <= int(fields[4]) or fields[6] not in ("+", "-", "."):
+            check_exon_line_format(fields)
+
+        exon = (int(fields[3]) - 1, int(fields[4]))
+        ch = fields[0]
+        reverse = fields[6] == "-"
+        match = TRANSCRIPT_ID_ATTRIBUTE.search(fields[8])
+        for transcript_id in (match.group(1),) if match is not None else exon_transcript_ids(fields[8]):
+            if transcript_ids is not None and transcript_id not in transcript_ids:
+                continue
+            exons = locus_exons.get((transcript_id, ch, reverse))
+            if exons is None:
+                exons = locus_exons[(transcript_id, sys.intern(ch), reverse)] = []
+            exons.append(exon)
+        rows_parsed += 1
+    gtf_file.close()
+
+    transcript_to_genomic_dict = {}
+    cigar_ops = 0
+    for (transcript_id, ch, reverse), exons in locus_exons.items():
+        alignment = exon_structure_alignment(transcript_id, ch, reverse, exons)
+        alignments = transcript_to_genomic_dict.get(transcript_id)
+        if all_loci and alignments is not None:
+            alignments.append(alignment)
+        else:
+            transcript_to_genomic_dict[transcript_id] = [alignment]
+        cigar_ops += len(alignment.cigar)
+    if stats is not None:
+        stats.count("rows_parsed", rows_parsed)
+        stats.count("cigar_ops", cigar_ops)
     return transcript_to_genomic_dict
 
 
+# Function that returns a context manager pausing the cyclic garbage collector, which would otherwise walk the
+# millions of exon records held while a GTF/GFF3 file is read again and again without freeing any of them
+@contextmanager
+def paused_gc():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# Function that returns the TranscriptAlignment of the exons of one transcript on one chr and strand, given as
+# (0-based start, end) genomic ranges in any order
+def exon_structure_alignment(transcript_id, ch, reverse, exons):
+    exons.sort()
+    cigar = []
+    chr_end = exons[0][0]
+    for start, end in exons:
+        if start < chr_end:
+            print("Error! Exons of transcript " + transcript_id + " overlap")
+            sys.exit()
+        if start > chr_end:
+            cigar.append((start - chr_end) << 4 | INTRON_OP)
+        cigar.append((end - start) << 4 | EXON_OP)
+        chr_end = end
+    return TranscriptAlignment(ch, exons[0][0], array("q", cigar), reverse)
+
+
+# Function that returns the transcript ids of the attribute column of a GTF or GFF3 exon line: its transcript_id
+# attribute, or else the ids of its GFF3 Parent attribute without their "transcript:" prefix (as written by Ensembl)
+def exon_transcript_ids(attributes):
+    match = TRANSCRIPT_ID_ATTRIBUTE.search(attributes)
+    if match is not None:
+        return [match.group(1)]
+    match = PARENT_ATTRIBUTE.search(attributes)
+    if match is None:
+        print("Error! GTF/GFF exon has no transcript_id or Parent attribute")
+        sys.exit()
+    return [parent[11:] if parent.startswith("transcript:") else parent for parent in match.group(1).split(",")]
+
+
+# Function to verify the format of a GTF/GFF3 exon line of a genome mapping file
+def check_exon_line_format(fields):
+    # check number of columns
+    if not len(fields) == 9:
+        print("Error! GTF/GFF file must contain 9 columns")
+        sys.exit()
+
+    # check start and end columns for 1-based integers, with the end not before the start
+    if not (fields[3].isdigit() and fields[4].isdigit()) or int(fields[3]) < 1:
+        print("Error! Exon coordinates must be integers")
+        sys.exit()
+    if int(fields[4]) < int(fields[3]):
+        print("Error! Exon end must not be before its start")
+        sys.exit()
+
+    # check the strand, where "." (unstranded) is read as the plus strand
+    if fields[6] not in ("+", "-", "."):
+        print("Error! Strand must be + or -")
+        sys.exit()
+
+
+# Function that validates one genome mapping row (transcript id, chr, start coordinate, cigar string),
+# stores it in transcript_to_genomic_dict and returns its TranscriptAlignment
+# The row replaces the earlier rows of the transcript, or with all_loci=True is added to them
+def add_genome_mapping_row(transcript_to_genomic_dict, rows, all_loci=False):
+    transcript_id, alignment = parse_genome_mapping_row(rows)
+    alignments = transcript_to_genomic_dict.get(transcript_id)
+    if all_loci and alignments is not None:
+        alignments.append(alignment)
+    else:
+        transcript_to_genomic_dict[transcript_id] = [alignment]
+    return alignment
+
+
+# Function that validates one genome mapping row and returns its transcript id and TranscriptAlignment
+# cigar_cache is passed on to "process_cigar_string"
+def parse_genome_mapping_row(rows, cigar_cache=_parsed_cigars):
+    # check input genome_map format
+    check_genome_map_line_format(rows)
+
+    transcript_id = rows[0]
+    chr_num = rows[1]
+    start_coord = rows[2]
+    cigar = rows[3]
+    reverse = len(rows) == 5 and rows[4] == "-"
+
+    return transcript_id, TranscriptAlignment(sys.intern(chr_num), int(start_coord),
+                                              process_cigar_string(cigar, cigar_cache), reverse)
+
+
+# Class holding the genome mapping of one transcript: the chr (interned, so every alignment on a chromosome
+# shares one name object), the 0-based start coordinate, the cigar packed into an array of int64 ops and whether
+# the transcript is aligned to the minus strand. As in SAM, the start coordinate and cigar of a minus strand
+# alignment are given on the plus strand, so transcript coordinate 0 is at the genomic end of the alignment
+class TranscriptAlignment:
+    __slots__ = ("chrom", "start_coord", "cigar", "reverse")
+
+    def __init__(self, chrom, start_coord, cigar, reverse=False):
+        self.chrom = chrom
+        self.start_coord = start_coord
+        self.cigar = cigar
+        self.reverse = reverse
+
+
 # Function that verifies the input genome mapping file format
-# verifies that every line in the genome mapping file contains 4 fields
+# verifies that every line in the genome mapping file contains 4 fields, or 5 with a strand (+ or -)
 # verifies that 3rd column in the genome mapping file is an integer
-# verifies that the cigar string contains valid characters
+# (the cigar string itself is validated while it is parsed by "process_cigar_string")
 def check_genome_map_line_format(genome_map_line_arr):
     # checks number of columns
-    if not len(genome_map_line_arr) == 4:
-        print("Error! Genome mapping file must have 4 columns")
+    if not len(genome_map_line_arr) in (4, 5):
+        print("Error! Genome mapping file must have 4 columns, or 5 with a strand")
         sys.exit()
 
     # checks if the third column contains an integer
@@ -65,163 +365,2386 @@ def check_genome_map_line_format(genome_map_line_arr):
         print("Error! Reference coordinate is invalid")
         sys.exit()
 
-    if not (re.search(r'\d+[MIDNSHP=X]', genome_map_line_arr[3], re.I)):
-        print("Error! CIGAR string contains invalid characters")
+    # checks if the optional fifth column is a strand
+    if len(genome_map_line_arr) == 5 and genome_map_line_arr[4] not in ("+", "-"):
+        print("Error! Strand must be + or -")
         sys.exit()
 
 
-# Function that processes cigar string and returns a list where each element of list
-# contains an integer and cigar char
-def process_cigar_string(cigar_string):
-    cigar_list = list()
-    cigar_int = ''
-    for cigar_char in cigar_string:
-        if not (cigar_char.isalpha() or cigar_char == '='):
-            cigar_int = cigar_int + cigar_char
+# Function that processes cigar string and returns an array where each element packs
+# an integer and the op code of its cigar char (integer << 4 | op code)
+# The string is validated and tokenized in a single pass; identical cigar strings return the same array from cache,
+# unless cache is None
+def process_cigar_string(cigar_string, cache=_parsed_cigars):
+    if cache is not None:
+        cigar_array = cache.get(cigar_string)
+        if cigar_array is not None:
+            return cigar_array
+
+    cigar_array = array("q")
+    end = 0
+    for token in CIGAR_TOKEN.finditer(cigar_string):
+        if token.start() != end:
+            break
+        cigar_array.append(int(token.group(1)) << 4 | CIGAR_OPS.index(token.group(2).upper()))
+        end = token.end()
+
+    # every character must belong to a consecutive integer + cigar char token
+    if end != len(cigar_string) or end == 0:
+        if re.search(r'[^\dMIDNSHP=X]', cigar_string, re.I):
+            print("Error! CIGAR string contains invalid characters")
         else:
-            if cigar_int == '':
-                print("Error! Wrong CIGAR string format")
-                sys.exit()
-            cigar_int = int(cigar_int)
-            cigar_list.append([cigar_int, cigar_char])
-            cigar_int = ''
-    return cigar_list
+            print("Error! Wrong CIGAR string format")
+        sys.exit()
+
+    if cache is not None:
+        if len(cache) >= CIGAR_CACHE_SIZE:
+            cache.clear()
+        cache[cigar_string] = cigar_array
+    return cigar_array
+
+
+# Function that unpacks a cigar array from "process_cigar_string" into a list where each element of list
+# contains an integer and cigar char
+def unpack_cigar(cigar_array):
+    return [[packed_op >> 4, CIGAR_OPS[packed_op & 0xf]] for packed_op in cigar_array]
 
 
 # Function to establish coordinate mappings using the cigar list
-# internally calls the "process_cigar_list" function that returns a dictionary containing coordinate correspondence
+# internally calls the "generate_block_index" function that returns a block index containing coordinate correspondence
 def map_coordinates(transcript_to_genomic_dict):
     coord_map = {}
     for tr in transcript_to_genomic_dict:
-        coord_map[tr] = {}
-        for ch in transcript_to_genomic_dict[tr]:
-            coord_map[tr][ch] = {}
-            start_coord = transcript_to_genomic_dict[tr][ch]["start_coord"]
-            cigar_vec = transcript_to_genomic_dict[tr][ch]["cigar"]
-            genomic_dict = generate_genomic_dict(start_coord, cigar_vec)
-            coord_map[tr][ch] = genomic_dict
+        coord_map[tr] = compile_transcript_map(transcript_to_genomic_dict[tr])
     return coord_map
 
 
+# Function that compiles the alignments of a single transcript into the TranscriptLoci of their block indexes
+# block_cache is passed on to "compile_cigar_blocks"
+def compile_transcript_map(alignments, block_cache=_compiled_cigar_blocks):
+    return TranscriptLoci([(alignment.chrom, generate_block_index(alignment.start_coord, alignment.cigar,
+                                                                  alignment.reverse, block_cache))
+                           for alignment in alignments])
+
+
+# Class holding the compiled loci of one transcript: a list of (chr, block index) pairs, one per genome mapping row,
+# in file order. "lookup" returns the genomic coordinate on every locus with a single binary search: when there are
+# several loci, the transcript axis is cut into elementary segments at every block start and end, and each segment
+# stores the (chr, offset, step) of the blocks covering it, where the genomic coordinate is offset + step * transcript
+# coordinate (step is -1 on the minus strand). The block indexes may also be per-base
+# dicts of "generate_genomic_dict", which are looked up one after the other
+class TranscriptLoci:
+    __slots__ = ("loci", "segment_starts", "segment_hits")
+
+    def __init__(self, loci):
+        self.loci = loci
+        self.segment_starts = None
+        self.segment_hits = None
+        if len(loci) > 1 and not any(isinstance(block_index, dict) for ch, block_index in loci):
+            self.build_segments()
+
+    # builds the elementary segments of the transcript axis and the blocks covering each of them
+    def build_segments(self):
+        boundaries = set()
+        for ch, block_index in self.loci:
+            for tr_start, length in zip(block_index.tr_starts, block_index.lengths):
+                boundaries.add(tr_start)
+                boundaries.add(tr_start + length)
+        segment_starts = sorted(boundaries)
+        segment_hits = [[] for segment in segment_starts]
+        for ch, block_index in self.loci:
+            step = -1 if block_index.reverse else 1
+            for tr_start, chr_offset, length in zip(block_index.tr_starts, block_index.chr_offsets,
+                                                    block_index.lengths):
+                offset = block_index.chr_start_coord + chr_offset - step * tr_start
+                for segment in range(bisect_left(segment_starts, tr_start),
+                                     bisect_left(segment_starts, tr_start + length)):
+                    segment_hits[segment].append((ch, offset, step))
+        self.segment_starts = segment_starts
+        self.segment_hits = [tuple(hits) for hits in segment_hits]
+
+    # returns the (chr, genomic coordinate) of the transcript coordinate on every locus that aligns it
+    def lookup(self, tr_coord):
+        if self.segment_starts is None:
+            matches = []
+            for ch, block_index in self.loci:
+                genomic_coord = block_index.get(tr_coord)
+                if genomic_coord is not None:
+                    matches.append((ch, genomic_coord))
+            return matches
+        segment = bisect_right(self.segment_starts, tr_coord) - 1
+        if segment < 0:
+            return []
+        return [(ch, offset + step * tr_coord) for ch, offset, step in self.segment_hits[segment]]
+
+    # returns the aligned pieces of the half-open transcript range [tr_start, tr_end) on every locus as a list of
+    # (chr, transcript start, transcript end, genomic start, genomic end) tuples
+    def get_range(self, tr_start, tr_end):
+        return [(ch,) + piece for ch, block_index in self.loci
+                for piece in map_transcript_range(block_index, tr_start, tr_end)]
+
+
+# Class that can be used in place of the "map_coordinates" result: a transcript is compiled on its first lookup
+# and then memoized, so only transcripts that are actually queried are ever compiled
+class LazyCoordMap:
+    def __init__(self, transcript_to_genomic_dict):
+        self.transcript_to_genomic_dict = transcript_to_genomic_dict
+        self.compiled = {}
+
+    def __contains__(self, tr):
+        return tr in self.transcript_to_genomic_dict
+
+    def __getitem__(self, tr):
+        transcript_map = self.compiled.get(tr)
+        if transcript_map is None:
+            transcript_map = compile_transcript_map(self.transcript_to_genomic_dict[tr])
+            self.compiled[tr] = transcript_map
+        return transcript_map
+
+
+# Class that can be used in place of the "map_coordinates" result: like "LazyCoordMap", transcripts are compiled on
+# their first lookup, but only the most recently used ones are kept, within a budget of max_entries transcripts
+# and/or max_bytes of estimated compiled size. With per_base=True, transcripts are expanded into the per-base dicts
+# of "generate_genomic_dict" for O(1) lookups instead of block indexes. hits, misses and evictions count the lookups
+class CachedCoordMap:
+    # translators that memoize compiled transcripts themselves keep at most this many, so that the budget holds
+    translator_memo_size = 1
+
+    def __init__(self, transcript_to_genomic_dict, max_entries=None, max_bytes=None, per_base=False):
+        self.transcript_to_genomic_dict = transcript_to_genomic_dict
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.per_base = per_base
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, tr):
+        return tr in self.transcript_to_genomic_dict
+
+    def __getitem__(self, tr):
+        cached = self.cache.get(tr)
+        if cached is not None:
+            self.hits += 1
+            self.cache.move_to_end(tr)
+            return cached[0]
+
+        alignments = self.transcript_to_genomic_dict[tr]
+        self.misses += 1
+        if self.per_base:
+            transcript_map = TranscriptLoci([(alignment.chrom, generate_genomic_dict(alignment.start_coord,
+                                                                                     unpack_cigar(alignment.cigar),
+                                                                                     alignment.reverse))
+                                             for alignment in alignments])
+        else:
+            # compiled outside the shared cigar block cache, so that evicting the transcript frees its blocks
+            transcript_map = compile_transcript_map(alignments, None)
+        size = transcript_map_size(transcript_map)
+        self.cache[tr] = (transcript_map, size)
+        self.cache_bytes += size
+
+        # evict the least recently used transcripts, always keeping the one just compiled
+        while len(self.cache) > 1 and ((self.max_entries is not None and len(self.cache) > self.max_entries) or
+                                       (self.max_bytes is not None and self.cache_bytes > self.max_bytes)):
+            self.cache_bytes -= self.cache.popitem(last=False)[1][1]
+            self.evictions += 1
+        return transcript_map
+
+    # returns the cache counters under the names used in the --stats-json report
+    def cache_counters(self):
+        return {"cache_hits": self.hits, "cache_misses": self.misses, "cache_evictions": self.evictions}
+
+
+# Function that returns the estimated size in bytes of a compiled transcript map holding block indexes or per-base
+# dicts (containers plus 28 bytes for each int they hold)
+def transcript_map_size(transcript_map):
+    size = sys.getsizeof(transcript_map) + sys.getsizeof(transcript_map.loci)
+    if transcript_map.segment_starts is not None:
+        size += sys.getsizeof(transcript_map.segment_starts) + sys.getsizeof(transcript_map.segment_hits)
+        size += sum([28 + sys.getsizeof(hits) + 80 * len(hits) for hits in transcript_map.segment_hits])
+    for ch, genomic_map in transcript_map.loci:
+        if isinstance(genomic_map, dict):
+            size += sys.getsizeof(genomic_map) + 56 * len(genomic_map)
+        else:
+            size += sys.getsizeof(genomic_map)
+            for values in (genomic_map.tr_starts, genomic_map.chr_offsets, genomic_map.lengths):
+                size += sys.getsizeof(values) + 28 * len(values)
+    return size
+
+
+# Class that can be used in place of the "map_coordinates" result when both the genome mapping file and the queries
+# are sorted by transcript id (e.g. with LC_ALL=C sort). Each lookup advances through the genome mapping file to the
+# requested transcript, so only the current transcript is held in memory, whatever the size of the inputs (its
+# cigars are parsed and compiled without the shared cigar caches, which would keep every transcript alive)
+# As in "create_transcript_genomic_dict", the last row of a transcript is used, or every row with all_loci=True
+class SortedMergeCoordMap:
+    # translators that memoize compiled transcripts themselves keep at most this many, so only one is held
+    translator_memo_size = 1
+
+    def __init__(self, genome_mapping_file, all_loci=False):
+        self.genome_map = open_file(genome_mapping_file, "r")
+        self.all_loci = all_loci
+        self.rows_parsed = 0
+        self.cigar_ops = 0
+        self.last_row_id = None
+        self.next_row = self.read_row()
+        self.tr = None
+        self.transcript_map = None
+
+    # returns the next (transcript id, TranscriptAlignment) row of the genome mapping file, or None at its end
+    def read_row(self):
+        for row in self.genome_map:
+            row = row.rstrip()
+            rows = re.split(r'\s+', row)
+            transcript_id, alignment = parse_genome_mapping_row(rows, None)
+            self.rows_parsed += 1
+            self.cigar_ops += len(alignment.cigar)
+            if self.last_row_id is not None and transcript_id < self.last_row_id:
+                print("Error! Genome mapping file is not sorted by transcript id")
+                sys.exit()
+            self.last_row_id = transcript_id
+            return transcript_id, alignment
+        return None
+
+    # moves to transcript tr, compiling its alignments if the genome mapping file has any
+    def advance(self, tr):
+        if tr == self.tr:
+            return
+        if self.tr is not None and tr < self.tr:
+            print("Error! Transcript processing file is not sorted by transcript id")
+            sys.exit()
+
+        alignments = []
+        while self.next_row is not None and self.next_row[0] <= tr:
+            if self.next_row[0] == tr:
+                if not self.all_loci:
+                    alignments = []
+                alignments.append(self.next_row[1])
+            self.next_row = self.read_row()
+        self.tr = tr
+        self.transcript_map = compile_transcript_map(alignments, None) if alignments else None
+
+    def __contains__(self, tr):
+        self.advance(tr)
+        return self.transcript_map is not None
+
+    def __getitem__(self, tr):
+        self.advance(tr)
+        if self.transcript_map is None:
+            raise KeyError(tr)
+        return self.transcript_map
+
+    def close(self):
+        self.genome_map.close()
+
+
+# Class holding the aligned (M/=/X) blocks of one transcript-chr mapping as sorted parallel lists:
+# transcript offset, genomic offset (relative to the chromosome start coordinate) and block length.
+# Lookups binary search the block starts, so memory and build time scale with the number of cigar ops
+# rather than with the transcript or intron length. The get/in/[] interface mirrors the per-base dict
+# returned by "generate_genomic_dict" so both can be used interchangeably.
+# With reverse=True (minus strand) the blocks are in transcript order as well, but the genomic offset of a block
+# is that of its first transcript base and the genomic coordinate decreases along the block
+class CigarBlockIndex:
+    __slots__ = ("chr_start_coord", "tr_starts", "chr_offsets", "lengths", "reverse")
+
+    def __init__(self, chr_start_coord, tr_starts, chr_offsets, lengths, reverse=False):
+        self.chr_start_coord = chr_start_coord
+        self.tr_starts = tr_starts
+        self.chr_offsets = chr_offsets
+        self.lengths = lengths
+        self.reverse = reverse
+
+    # returns the genomic coordinate for the transcript coordinate, or default if it is not aligned
+    def get(self, tr_coord, default=None):
+        block = bisect_right(self.tr_starts, tr_coord) - 1
+        if block < 0:
+            return default
+        offset = tr_coord - self.tr_starts[block]
+        if offset >= self.lengths[block]:
+            return default
+        if self.reverse:
+            return self.chr_start_coord + self.chr_offsets[block] - offset
+        return self.chr_start_coord + self.chr_offsets[block] + offset
+
+    # returns the aligned pieces of the half-open transcript range [tr_start, tr_end) as a list of
+    # (transcript start, transcript end, genomic start, genomic end) tuples, one per overlapped block
+    # The pieces are in transcript order; on the minus strand their genomic ranges are still given start < end
+    def get_range(self, tr_start, tr_end):
+        pieces = []
+        block = max(bisect_right(self.tr_starts, tr_start) - 1, 0)
+        while block < len(self.tr_starts) and self.tr_starts[block] < tr_end:
+            start = max(tr_start, self.tr_starts[block])
+            end = min(tr_end, self.tr_starts[block] + self.lengths[block])
+            if start < end:
+                if self.reverse:
+                    genomic_end = self.chr_start_coord + self.chr_offsets[block] - (start - self.tr_starts[block]) + 1
+                    pieces.append((start, end, genomic_end - (end - start), genomic_end))
+                else:
+                    genomic_start = self.chr_start_coord + self.chr_offsets[block] + start - self.tr_starts[block]
+                    pieces.append((start, end, genomic_start, genomic_start + end - start))
+            block += 1
+        return pieces
+
+    def __contains__(self, tr_coord):
+        return self.get(tr_coord) is not None
+
+    def __getitem__(self, tr_coord):
+        genomic_coord = self.get(tr_coord)
+        if genomic_coord is None:
+            raise KeyError(tr_coord)
+        return genomic_coord
+
+
+# Function that returns a CigarBlockIndex for the chromosome start coordinate and packed cigar array, on the minus
+# strand if reverse is True
+def generate_block_index(chr_start_coord, cigar_arr, reverse=False, block_cache=_compiled_cigar_blocks):
+    tr_starts, chr_offsets, lengths = compile_cigar_blocks(cigar_arr, reverse, block_cache)
+    return CigarBlockIndex(chr_start_coord, tr_starts, chr_offsets, lengths, reverse)
+
+
+# Function that returns the aligned blocks of a packed cigar array as (transcript offsets, genomic offsets, lengths)
+# Consecutive aligned ops (e.g. 5M3=) are merged into a single block. The genomic offsets are relative to the
+# start coordinate, so the result only depends on the cigar and is cached in cache (unless it is None) and shared
+# by every alignment using it
+# With reverse=True the blocks of a minus strand alignment are returned in transcript order: transcript coordinate t
+# is base L - 1 - t of the cigar, where L is the transcript length (the M/I/S/=/X ops), and the genomic offset of a
+# block is that of its first transcript base (see "CigarBlockIndex")
+def compile_cigar_blocks(cigar_arr, reverse=False, cache=_compiled_cigar_blocks):
+    if cache is not None:
+        key = (cigar_arr.tobytes(), reverse)
+        blocks = cache.get(key)
+        if blocks is not None:
+            return blocks
+
+    tr_starts = []
+    chr_offsets = []
+    lengths = []
+    tr_idx = 0
+    chr_idx = 0
+
+    for packed_op in cigar_arr:
+        cigar_int = packed_op >> 4
+        op_code = packed_op & 0xf
+
+        # input: query and reference
+        if op_code in ALIGNED_CIGAR_OPS:
+            if lengths and tr_starts[-1] + lengths[-1] == tr_idx and chr_offsets[-1] + lengths[-1] == chr_idx:
+                lengths[-1] += cigar_int
+            elif cigar_int > 0:
+                tr_starts.append(tr_idx)
+                chr_offsets.append(chr_idx)
+                lengths.append(cigar_int)
+            tr_idx += cigar_int
+            chr_idx += cigar_int
+        # input: reference
+        elif op_code in REFERENCE_CIGAR_OPS:
+            chr_idx += cigar_int
+        # input: query
+        elif op_code in QUERY_CIGAR_OPS:
+            tr_idx += cigar_int
+
+    if reverse:
+        tr_starts = [tr_idx - tr_start - length for tr_start, length in zip(tr_starts[::-1], lengths[::-1])]
+        chr_offsets = [chr_offset + length - 1 for chr_offset, length in zip(chr_offsets[::-1], lengths[::-1])]
+        lengths = lengths[::-1]
+    blocks = (tr_starts, chr_offsets, lengths)
+    if cache is not None:
+        if len(cache) >= CIGAR_CACHE_SIZE:
+            cache.clear()
+        cache[key] = blocks
+    return blocks
+
+
+# Function that returns the transcript length of a packed cigar array: the sum of its M/I/S/=/X ops
+def transcript_length(cigar_arr):
+    return sum([packed_op >> 4 for packed_op in cigar_arr
+                if (packed_op & 0xf) in ALIGNED_CIGAR_OPS or (packed_op & 0xf) in QUERY_CIGAR_OPS])
+
+
+# Function that writes the compiled block indexes of every transcript-chr mapping to a binary index file
+# The mappings are sorted by transcript id so that "MappedCoordMap" can binary search the id table in place;
+# the loci of a transcript follow each other in file order
+def build_index_file(transcript_to_genomic_dict, index_path):
+    chroms = {}
+    tr_ids = []
+    tr_chroms = array("q")
+    tr_starts = array("q")
+    tr_reverse = array("q")
+    tr_block_offsets = array("q", [0])
+    block_tr_starts = array("q")
+    block_chr_offsets = array("q")
+    block_lengths = array("q")
+
+    for tr in sorted(transcript_to_genomic_dict, key=lambda tr_id: tr_id.encode("utf-8")):
+        for alignment in transcript_to_genomic_dict[tr]:
+            block_index = generate_block_index(alignment.start_coord, alignment.cigar, alignment.reverse)
+            tr_ids.append(tr.encode("utf-8"))
+            tr_chroms.append(chroms.setdefault(alignment.chrom, len(chroms)))
+            tr_starts.append(block_index.chr_start_coord)
+            tr_reverse.append(int(alignment.reverse))
+            block_tr_starts.extend(block_index.tr_starts)
+            block_chr_offsets.extend(block_index.chr_offsets)
+            block_lengths.extend(block_index.lengths)
+            tr_block_offsets.append(len(block_lengths))
+
+    chrom_names = [ch.encode("utf-8") for ch in chroms]
+    index_file = open(index_path, "wb")
+    index_file.write(INDEX_MAGIC)
+    index_file.write(INDEX_HEADER.pack(1, len(tr_ids), len(chrom_names), len(block_lengths)))
+    for section in (name_offsets(chrom_names), b"".join(chrom_names), name_offsets(tr_ids), b"".join(tr_ids),
+                    tr_chroms, tr_starts, tr_reverse, tr_block_offsets, block_tr_starts, block_chr_offsets,
+                    block_lengths):
+        data = bytes(section)
+        index_file.write(data)
+        index_file.write(b"\0" * (-len(data) % 8))
+    index_file.close()
+
+
+# Function that returns the int64 offsets of a list of names in their concatenated blob
+def name_offsets(names):
+    offsets = array("q", [0])
+    for name in names:
+        offsets.append(offsets[-1] + len(name))
+    return offsets
+
+
+# Class giving sequence access to the names stored in a memory-mapped index. Names are sliced straight out of the
+# mapped file, which returns them as bytes without going through a memoryview
+class IndexNameTable:
+    __slots__ = ("offsets", "buffer", "start")
+
+    def __init__(self, offsets, buffer, start):
+        self.offsets = offsets
+        self.buffer = buffer
+        self.start = start
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.buffer[self.start + self.offsets[i]:self.start + self.offsets[i + 1]]
+
+    # returns the position of the first occurrence of name in the sorted table, or -1 if it is not there. The
+    # binary search is inlined, as it runs for every transcript that is not memoized
+    def first(self, name):
+        buffer, start, offsets = self.buffer, self.start, self.offsets
+        lo, hi = 0, len(offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if buffer[start + offsets[mid]:start + offsets[mid + 1]] < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(offsets) - 1 and buffer[start + offsets[lo]:start + offsets[lo + 1]] == name:
+            return lo
+        return -1
+
+
+# Class that can be used in place of the "map_coordinates" result and answers lookups straight from a
+# memory-mapped index file written by "build_index_file". Nothing is deserialized up front: transcript ids are
+# binary searched in the file and block indexes are views into the mapped block arrays, so concurrent jobs
+# reading the same index share the page cache
+class MappedCoordMap:
+    # translators that memoize compiled transcripts themselves keep at most this many, so that INDEX_MEMO_SIZE holds
+    translator_memo_size = 1
+
+    def __init__(self, index_path):
+        if os.path.getsize(index_path) < len(INDEX_MAGIC) + INDEX_HEADER.size:
+            print("Error! Index file format is invalid")
+            sys.exit()
+        index_file = open(index_path, "rb")
+        self.buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        index_file.close()
+        if self.buffer[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            print("Error! Index file format is invalid")
+            sys.exit()
+        byte_order, n_mappings, n_chroms, n_blocks = INDEX_HEADER.unpack_from(self.buffer, len(INDEX_MAGIC))
+        if byte_order != 1:
+            print("Error! Index file was built on a platform with a different byte order")
+            sys.exit()
+
+        view = memoryview(self.buffer)
+        self.position = len(INDEX_MAGIC) + INDEX_HEADER.size
+        chrom_offsets = self.read_section(view, n_chroms + 1)
+        chrom_table = IndexNameTable(chrom_offsets, self.buffer, self.position)
+        self.read_section(view, chrom_offsets[-1], "B")
+        tr_offsets = self.read_section(view, n_mappings + 1)
+        self.tr_ids = IndexNameTable(tr_offsets, self.buffer, self.position)
+        self.read_section(view, tr_offsets[-1], "B")
+        self.tr_chroms = self.read_section(view, n_mappings)
+        self.tr_starts = self.read_section(view, n_mappings)
+        self.tr_reverse = self.read_section(view, n_mappings)
+        self.tr_block_offsets = self.read_section(view, n_mappings + 1)
+        self.block_tr_starts = self.read_section(view, n_blocks)
+        self.block_chr_offsets = self.read_section(view, n_blocks)
+        self.block_lengths = self.read_section(view, n_blocks)
+        self.chroms = [chrom_table[i].decode("utf-8") for i in range(len(chrom_table))]
+        self.compiled = OrderedDict()
+
+    # returns a view of the next section of the file with count items of the given format
+    def read_section(self, view, count, fmt="q"):
+        size = count * struct.calcsize(fmt)
+        # a truncated or corrupt file is shorter than the sections its header announces
+        if count < 0 or self.position + size > len(view):
+            print("Error! Index file format is invalid")
+            sys.exit()
+        section = view[self.position:self.position + size].cast(fmt)
+        self.position += size + (-size % 8)
+        return section
+
+    # returns the compiled transcript, or None if the id is not in the index. The last INDEX_MEMO_SIZE transcripts
+    # found are memoized, so that "in" followed by [] searches the id table once
+    def find(self, tr):
+        transcript_map = self.compiled.get(tr)
+        if transcript_map is not None:
+            self.compiled.move_to_end(tr)
+            return transcript_map
+
+        key = tr.encode("utf-8")
+        i = self.tr_ids.first(key)
+        if i < 0:
+            return None
+        loci = []
+        while i < len(self.tr_ids) and self.tr_ids[i] == key:
+            lo = self.tr_block_offsets[i]
+            hi = self.tr_block_offsets[i + 1]
+            loci.append((self.chroms[self.tr_chroms[i]], CigarBlockIndex(
+                self.tr_starts[i], self.block_tr_starts[lo:hi], self.block_chr_offsets[lo:hi],
+                self.block_lengths[lo:hi], bool(self.tr_reverse[i]))))
+            i += 1
+        transcript_map = TranscriptLoci(loci)
+        self.compiled[tr] = transcript_map
+        if len(self.compiled) > INDEX_MEMO_SIZE:
+            self.compiled.popitem(last=False)
+        return transcript_map
+
+    def __contains__(self, tr):
+        return self.find(tr) is not None
+
+    def __getitem__(self, tr):
+        transcript_map = self.find(tr)
+        if transcript_map is None:
+            raise KeyError(tr)
+        return transcript_map
+
+
+# Function that ingests a genome mapping file into a SQLite alignment store (see STORE_SCHEMA) at store_path,
+# replacing any existing file. Rows are streamed and inserted in batches of batch_size, so the mapping file never
+# has to fit in memory. With all_loci=True every row of a transcript is kept, otherwise only its last row
+# The exons of a GTF/GFF3 genome mapping file (see mapping_format) are grouped in memory before they are inserted
+def build_sqlite_store(genome_mapping_file, store_path, batch_size=65536, all_loci=False, mapping_format=None):
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    connection = sqlite3.connect(store_path)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.executescript(STORE_SCHEMA)
+
+    chroms = {}
+    transcripts = []
+    blocks = []
+    for row_number, (transcript_id, alignment) in enumerate(genome_mapping_alignments(genome_mapping_file,
+                                                                                      mapping_format)):
+        chrom_id = chroms.get(alignment.chrom)
+        if chrom_id is None:
+            chrom_id = chroms[alignment.chrom] = len(chroms)
+            connection.execute("INSERT INTO chromosomes VALUES (?, ?)", (chrom_id, alignment.chrom))
+        transcripts.append((transcript_id, row_number, chrom_id, alignment.start_coord, int(alignment.reverse)))
+        tr_starts, chr_offsets, lengths = compile_cigar_blocks(alignment.cigar, alignment.reverse)
+        blocks.extend(zip([row_number] * len(lengths), tr_starts, chr_offsets, lengths))
+        if len(blocks) >= batch_size or len(transcripts) >= batch_size:
+            insert_store_rows(connection, transcripts, blocks)
+            transcripts = []
+            blocks = []
+    insert_store_rows(connection, transcripts, blocks)
+
+    # drop the rows replaced by a later row of the same transcript and their blocks, then index the blocks by row
+    if not all_loci:
+        connection.execute("DELETE FROM transcripts WHERE row NOT IN (SELECT MAX(row) FROM transcripts GROUP BY tr_id)")
+    connection.execute("DELETE FROM blocks WHERE row NOT IN (SELECT row FROM transcripts)")
+    connection.execute("CREATE INDEX blocks_row ON blocks (row, tr_start)")
+    connection.execute("PRAGMA user_version = " + str(STORE_SCHEMA_VERSION))
+    connection.commit()
+    connection.close()
+
+
+# Generator of the (transcript id, TranscriptAlignment) rows of a genome mapping file in file order: the rows of a
+# cigar file are streamed, and the loci of a GTF/GFF3 file are grouped by "create_exon_structure_dict" first
+def genome_mapping_alignments(genome_mapping_file, mapping_format=None):
+    if (mapping_format or detect_mapping_format(genome_mapping_file)) == "gtf":
+        for transcript_id, alignments in create_exon_structure_dict(genome_mapping_file, all_loci=True).items():
+            for alignment in alignments:
+                yield transcript_id, alignment
+        return
+
+    genome_map = open_file(genome_mapping_file, "r")
+    for row in genome_map:
+        row = row.rstrip()
+        yield parse_genome_mapping_row(re.split(r'\s+', row))
+    genome_map.close()
+
+
+# Function that inserts a batch of transcript and block rows into a SQLite alignment store
+def insert_store_rows(connection, transcripts, blocks):
+    connection.executemany("INSERT INTO transcripts VALUES (?, ?, ?, ?, ?)", transcripts)
+    connection.executemany("INSERT INTO blocks VALUES (?, ?, ?, ?)", blocks)
+
+
+# Class that can be used in place of the "map_coordinates" result and answers lookups from a SQLite alignment store
+# written by "build_sqlite_store", for mappings too large to hold in memory. Compiled transcripts (and unknown ids)
+# are kept in an LRU cache of cache_size entries; "prefetch" loads many transcripts with a few set-based queries,
+# and is called by the translators for each batch of queries. Each process opens its own connection, so the map
+# can be shared with forked workers
+class SqliteCoordMap:
+    # translators that memoize compiled transcripts themselves keep at most this many, so that cache_size holds
+    translator_memo_size = 1
+
+    def __init__(self, store_path, cache_size=STORE_CACHE_SIZE):
+        self.store_path = store_path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.connection = None
+        self.pid = None
+        if self.connect().execute("PRAGMA user_version").fetchone()[0] != STORE_SCHEMA_VERSION:
+            print("Error! Alignment store format is invalid")
+            sys.exit()
+
+    # returns the connection of the current process, opening it read-only if needed
+    def connect(self):
+        if self.pid != os.getpid():
+            # the path is percent-encoded so that characters such as # ? % are not read as parts of the URI
+            self.connection = sqlite3.connect(Path(self.store_path).resolve().as_uri() + "?mode=ro", uri=True)
+            self.pid = os.getpid()
+        return self.connection
+
+    # loads the transcripts that are not cached yet, STORE_LOOKUP_SIZE ids per query
+    def prefetch(self, tr_ids):
+        missing = [tr for tr in dict.fromkeys(tr_ids) if tr not in self.cache]
+        for start in range(0, len(missing), STORE_LOOKUP_SIZE):
+            lookup = missing[start:start + STORE_LOOKUP_SIZE]
+            loci = {tr: [] for tr in lookup}
+            rows = self.connect().execute(
+                "SELECT t.tr_id, t.row, c.name, t.chr_start, t.reverse, b.tr_start, b.chr_offset, b.length "
+                "FROM transcripts t JOIN chromosomes c ON c.id = t.chrom_id "
+                "LEFT JOIN blocks b ON b.row = t.row "
+                "WHERE t.tr_id IN (" + ",".join("?" * len(lookup)) + ") ORDER BY t.tr_id, t.row, b.tr_start", lookup)
+            last_row = None
+            for tr, row, ch, chr_start, reverse, tr_start, chr_offset, length in rows:
+                if row != last_row:
+                    block_index = CigarBlockIndex(chr_start, array("q"), array("q"), array("q"), bool(reverse))
+                    loci[tr].append((sys.intern(ch), block_index))
+                    last_row = row
+                if length is not None:
+                    block_index.tr_starts.append(tr_start)
+                    block_index.chr_offsets.append(chr_offset)
+                    block_index.lengths.append(length)
+            for tr, transcript_loci in loci.items():
+                self.cache_transcript(tr, TranscriptLoci(transcript_loci) if transcript_loci else None)
+
+    # adds a compiled transcript (None for an unknown id) to the cache, evicting the least recently used one
+    def cache_transcript(self, tr, transcript_map):
+        self.cache[tr] = transcript_map
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    # returns the compiled transcript, or None if the id is unknown
+    def lookup(self, tr):
+        if tr not in self.cache:
+            self.prefetch([tr])
+        self.cache.move_to_end(tr)
+        return self.cache[tr]
+
+    def __contains__(self, tr):
+        return self.lookup(tr) is not None
+
+    def __getitem__(self, tr):
+        transcript_map = self.lookup(tr)
+        if transcript_map is None:
+            raise KeyError(tr)
+        return transcript_map
+
+
+# Function that returns query_lines unchanged, or if coord_map can prefetch transcripts, yields them while looking
+# up the transcripts of every PREFETCH_LINES lines with one "prefetch" call
+def prefetch_query_lines(query_lines, coord_map):
+    if not hasattr(coord_map, "prefetch"):
+        return query_lines
+    return prefetch_query_batches(query_lines, coord_map)
+
+
+# Generator used by "prefetch_query_lines"
+def prefetch_query_batches(query_lines, coord_map):
+    batch = []
+    for query in query_lines:
+        batch.append(query)
+        if len(batch) >= PREFETCH_LINES:
+            prefetch_transcripts(batch, coord_map)
+            yield from batch
+            batch = []
+    prefetch_transcripts(batch, coord_map)
+    yield from batch
+
+
+# Function that prefetches the transcripts named in the first field of a batch of text or binary query lines
+def prefetch_transcripts(query_batch, coord_map):
+    tr_ids = []
+    for query in query_batch:
+        first_field = query.split(None, 1)
+        if first_field:
+            tr_ids.append(first_field[0].decode("utf-8") if isinstance(first_field[0], bytes) else first_field[0])
+    coord_map.prefetch(tr_ids)
+
+
+# Class for using the translation from Python: a compiled coordinate map that is built once and then queried
+# with single coordinates, parallel lists of coordinates or a stream of (transcript id, coordinate) rows.
+# Lookups return a list of (chr, genomic coordinate) pairs, which is empty when the transcript is unknown
+# or the coordinate is not aligned
+class TranscriptMapper:
+    def __init__(self, coord_map):
+        self.coord_map = coord_map
+
+    # builds a mapper from a genome mapping file (with cigar strings, or GTF/GFF3 exons), keeping the last row of
+    # each transcript or, with all_loci=True, every row
+    @classmethod
+    def from_file(cls, genome_mapping_file, lazy=False, all_loci=False, mapping_format=None):
+        return cls.from_alignments(create_transcript_genomic_dict(genome_mapping_file, all_loci=all_loci,
+                                                                  mapping_format=mapping_format), lazy)
+
+    # builds a mapper from a compiled index file written by "build_index_file"
+    @classmethod
+    def from_index(cls, index_file):
+        return cls(MappedCoordMap(index_file))
+
+    # builds a mapper from a SQLite alignment store written by "build_sqlite_store"
+    @classmethod
+    def from_store(cls, store_path, cache_size=STORE_CACHE_SIZE):
+        return cls(SqliteCoordMap(store_path, cache_size))
+
+    # builds a mapper from an iterable of (transcript id, chr, start coordinate, cigar string[, strand]) rows
+    @classmethod
+    def from_rows(cls, rows, lazy=False, all_loci=False):
+        transcript_to_genomic_dict = {}
+        for row in rows:
+            add_genome_mapping_row(transcript_to_genomic_dict, [str(field) for field in row], all_loci)
+        return cls.from_alignments(transcript_to_genomic_dict, lazy)
+
+    # builds a mapper from the result of "create_transcript_genomic_dict"
+    @classmethod
+    def from_alignments(cls, transcript_to_genomic_dict, lazy=False):
+        if lazy:
+            return cls(LazyCoordMap(transcript_to_genomic_dict))
+        return cls(map_coordinates(transcript_to_genomic_dict))
+
+    def __contains__(self, tr_id):
+        return tr_id in self.coord_map
+
+    def map(self, tr_id, pos):
+        if not (tr_id in self.coord_map):
+            return []
+        return self.coord_map[tr_id].lookup(pos)
+
+    # returns the aligned pieces of the half-open transcript range [start, end) as a list of
+    # (chr, transcript start, transcript end, genomic start, genomic end) tuples
+    def map_range(self, tr_id, start, end):
+        if not (tr_id in self.coord_map):
+            return []
+        return self.coord_map[tr_id].get_range(start, end)
+
+    def map_many(self, ids, positions):
+        ids = list(ids)
+        if hasattr(self.coord_map, "prefetch"):
+            self.coord_map.prefetch(ids)
+        return [self.map(tr_id, pos) for tr_id, pos in zip(ids, positions)]
+
+    # yields one (transcript id, coordinate, chr, genomic coordinate) tuple per mapped coordinate,
+    # the same rows "merge_transcript_file" writes to its output
+    def map_stream(self, rows):
+        for tr_id, pos in rows:
+            for ch, genomic_coord in self.map(tr_id, pos):
+                yield tr_id, pos, ch, genomic_coord
+
+
 # Function that returns a dictionary containing the genomic coordinate corresponding
 # to the transcript coord and chromosome
 # Assumptions:
 # 1. Every transcript coordinate is mapped to a unique genomic coordinate
 # 2. Cigar string contains only 3 chars (M,D,I)
-def generate_genomic_dict(chr_start_coord, cigar_arr):
+def generate_genomic_dict(chr_start_coord, cigar_arr, reverse=False):
     genomic_dict = {}
     tr_idx = 0
     chr_idx = chr_start_coord
+    # on the minus strand, cigar base i is transcript coordinate tr_length - 1 - i
+    tr_length = sum([entry[0] for entry in cigar_arr if entry[1].upper() in "M=XIS"])
 
     for entry in cigar_arr:
         cigar_int = entry[0]
-        cigar_char = entry[1]
+        cigar_char = entry[1].upper()
 
         # input: query and reference
-        if re.match(r'[M=X]', cigar_char, re.I):
-            for idx in range(cigar_int):
-                genomic_dict[tr_idx] = chr_idx
-                tr_idx += 1
-                chr_idx += 1
+        if cigar_char in "M=X":
+            if reverse:
+                genomic_dict.update(zip(range(tr_length - 1 - tr_idx, tr_length - 1 - tr_idx - cigar_int, -1),
+                                        range(chr_idx, chr_idx + cigar_int)))
+            else:
+                genomic_dict.update(zip(range(tr_idx, tr_idx + cigar_int), range(chr_idx, chr_idx + cigar_int)))
+            tr_idx += cigar_int
+            chr_idx += cigar_int
         # input: reference
-        elif re.match(r'[DN]', cigar_char, re.I):
-            for idx in range(cigar_int):
-                chr_idx += 1
+        elif cigar_char in "DN":
+            chr_idx += cigar_int
         # input: query
-        elif re.match(r'[IS]', cigar_char, re.I):
-            for idx in range(cigar_int):
-                tr_idx += 1
+        elif cigar_char in "IS":
+            tr_idx += cigar_int
 
     return genomic_dict
 
 
+# Function that streams the transcript processing file and returns the set of transcript ids it references
+def collect_query_transcript_ids(transcript_processing_filename):
+    transcript_ids = set()
+    transcript_processing_file = open_file(transcript_processing_filename, "r")
+    for query in transcript_processing_file:
+        first_field = query.split(None, 1)
+        if first_field:
+            transcript_ids.add(first_field[0])
+    transcript_processing_file.close()
+    return transcript_ids
+
+
 # Function to read in transcript processing file and coord_map from the map_coordinates function
 # results are written to --output
-def merge_transcript_file(transcript_processing_filename, coord_map, output):
-    transcript_processing_file = open(transcript_processing_filename, "r")
-    output_file = open(output, "w")
-    for query in transcript_processing_file:
+# engine selects the query translator: "python" (line by line), "bytes" (line by line without decoding)
+# or "numpy" (batches of NUMPY_BATCH_LINES queries at once)
+# If a RunStats is given, the queries, output rows and misses are counted in it
+# Misses are passed to report (by default printed, see "print_miss" and "MissReporter")
+def merge_transcript_file(transcript_processing_filename, coord_map, output, engine="python", stats=None,
+                          report=None, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, compression=None):
+    transcript_processing_file = open_input(transcript_processing_filename, engine == "bytes")
+    output_file = BatchWriter(output, engine == "bytes", buffer_size, compression)
+    query_lines, write = transcript_processing_file, output_file.write
+    if report is None:
+        report = print_miss
+    if stats is not None:
+        query_lines, write, report = stats.instrument(query_lines, write, report)
+    # the rows batched before a malformed query line exits are still written
+    try:
+        get_query_translator(engine)(query_lines, coord_map, write, report)
+    finally:
+        close_input(transcript_processing_file)
+        output_file.close()
+
+
+# Function that opens a file with mode "r", "rb", "w" or "wb", compressing or decompressing it on the fly if the
+# filename ends in .gz, .bz2 or .xz
+def open_file(filename, mode="r"):
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(filename)[1].lower())
+    if opener is None:
+        return open(filename, mode)
+    return opener(filename, mode if "b" in mode else mode + "t")
+
+
+# Function that returns whether a file is compressed, judging by its filename extension
+def is_compressed(filename):
+    return os.path.splitext(filename)[1].lower() in COMPRESSED_OPENERS
+
+
+# Function that opens an input file for reading, or returns stdin if the filename is "-"
+def open_input(filename, binary=False):
+    if filename == "-":
+        return sys.stdin.buffer if binary else sys.stdin
+    return open_file(filename, "rb" if binary else "r")
+
+
+# Function that closes an input file opened by "open_input", leaving stdin open
+def close_input(input_file):
+    if input_file is not sys.stdin and input_file is not sys.stdin.buffer:
+        input_file.close()
+
+
+# Function that returns the size in bytes of an input file, or 0 for stdin
+def input_size(filename):
+    if filename == "-":
+        return 0
+    return os.path.getsize(filename)
+
+
+# Function that opens output for writing and returns the file and whether it must be closed (rather than only
+# flushed) when done. output is a filename, "-" for stdout or an already open file
+# compression is None to compress by filename extension, "none" to write uncompressed or "bgzf" to write BGZF blocks
+def open_output(output, binary=False, compression=None):
+    if output == "-" or not isinstance(output, str):
+        stream = sys.stdout if output == "-" else output
+        stream.flush()
+        if compression != "bgzf":
+            return (stream.buffer if binary and hasattr(stream, "buffer") else stream), False
+        output_file = BgzfWriter(stream.buffer if hasattr(stream, "buffer") else stream, False)
+    elif compression == "bgzf":
+        output_file = BgzfWriter(open(output, "wb"))
+    elif compression == "none":
+        return open(output, "wb" if binary else "w"), True
+    else:
+        return open_file(output, "wb" if binary else "w"), True
+    if not binary:
+        output_file = io.TextIOWrapper(output_file)
+    return output_file, True
+
+
+# Function that compresses data into BGZF blocks, gzip members holding at most BGZF_BLOCK_SIZE bytes each
+# The concatenated results of several calls are a valid BGZF (and gzip) stream once BGZF_EOF is appended
+def bgzf_compress(data, level=6):
+    blocks = []
+    for start in range(0, len(data), BGZF_BLOCK_SIZE):
+        block = data[start:start + BGZF_BLOCK_SIZE]
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        deflated = compressor.compress(block) + compressor.flush()
+        blocks.append(BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25))
+        blocks.append(deflated)
+        blocks.append(struct.pack("<II", zlib.crc32(block), len(block)))
+    return b"".join(blocks)
+
+
+# Class for writing BGZF to a binary file: data is compressed one full block at a time, and "close" compresses
+# the rest and writes the end-of-file block. The file is only closed if owns_file is True
+class BgzfWriter(io.BufferedIOBase):
+    def __init__(self, output_file, owns_file=True):
+        super().__init__()
+        self.output_file = output_file
+        self.owns_file = owns_file
+        self.pending = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.pending += data
+        if len(self.pending) >= BGZF_BLOCK_SIZE:
+            end = len(self.pending) - len(self.pending) % BGZF_BLOCK_SIZE
+            self.output_file.write(bgzf_compress(bytes(self.pending[:end])))
+            del self.pending[:end]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.output_file.write(bgzf_compress(bytes(self.pending)) + BGZF_EOF)
+            self.pending = bytearray()
+            if self.owns_file:
+                self.output_file.close()
+            else:
+                self.output_file.flush()
+        super().close()
+
+
+# Class collecting output lines and writing them to the output file in batches of about buffer_size bytes,
+# so that the translators make a few large writes instead of one small write per output row
+# output and compression are passed to "open_output"; an already open file is flushed but not closed by "close"
+class BatchWriter:
+    def __init__(self, output, binary=False, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, compression=None):
+        self.output_file, self.owns_file = open_output(output, binary, compression)
+        self.empty = b"" if binary else ""
+        self.buffer_size = buffer_size
+        self.batch = []
+        self.batch_bytes = 0
+
+    def write(self, text):
+        self.batch.append(text)
+        self.batch_bytes += len(text)
+        if self.batch_bytes >= self.buffer_size:
+            self.flush()
+
+    # writes the batched lines to the output file
+    def flush(self):
+        if self.batch:
+            self.output_file.write(self.empty.join(self.batch))
+            self.batch = []
+            self.batch_bytes = 0
+
+    def close(self):
+        self.flush()
+        if self.owns_file:
+            self.output_file.close()
+        else:
+            self.output_file.flush()
+
+
+# Function that returns the message printed for a query that produced no output row
+# (tr_coord is "start-end" for a range query, and for a genomic query tr_id and tr_coord are the chr and coordinate)
+def format_miss_message(reason, tr_id, tr_coord):
+    if reason == MISS_UNKNOWN_CHROMOSOME:
+        return "Chromosome " + tr_id + " does not exist in genome mapping file"
+    if reason == MISS_UNCOVERED_COORDINATE:
+        return "Genomic coordinate " + tr_coord + " on chromosome " + tr_id + " is not covered by any transcript"
+    if reason == MISS_UNKNOWN_TRANSCRIPT:
+        return "Transcript " + tr_id + " does not exist in genome mapping file"
+    if "-" in tr_coord:
+        return "Transcript range " + tr_coord + " for transcript " + tr_id + " is not aligned"
+    return "Transcript coordinate " + tr_coord + " for transcript " + tr_id + " does not exist"
+
+
+# Function that prints the message for a query that produced no output row
+def print_miss(reason, tr_id, tr_coord):
+    print(format_miss_message(reason, tr_id, tr_coord))
+
+
+# Class that can be passed as report to the translators instead of "print_miss"
+# Misses are written in batches to an optional rejects file (transcript id, transcript coordinate and reason code
+# per row), at most max_messages of them are printed, and "close" prints a summary count of the misses for each
+# of the reasons
+class MissReporter:
+    def __init__(self, rejects_path=None, max_messages=None, batch_size=65536,
+                 reasons=(MISS_UNKNOWN_TRANSCRIPT, MISS_UNMAPPED_COORDINATE)):
+        self.rejects_path = rejects_path
+        self.rejects_file = None if rejects_path is None else open(rejects_path, "w")
+        self.max_messages = max_messages
+        self.batch_size = batch_size
+        self.batch = []
+        self.counts = dict.fromkeys(reasons, 0)
+
+    def __call__(self, reason, tr_id, tr_coord):
+        self.counts[reason] += 1
+        if self.rejects_file is not None:
+            self.batch.append(tr_id + "\t" + tr_coord + "\t" + reason + "\n")
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+        if self.max_messages is not None and sum(self.counts.values()) <= self.max_messages:
+            print_miss(reason, tr_id, tr_coord)
+
+    # writes the batched rejects to the rejects file
+    def flush(self):
+        if self.rejects_file is not None:
+            self.rejects_file.write("".join(self.batch))
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        if self.rejects_file is not None:
+            self.rejects_file.close()
+
+        total = sum(self.counts.values())
+        summary = str(total) + " queries were not translated (" + ", ".join(
+            [str(count) + " " + reason for reason, count in self.counts.items()]) + ")"
+        if self.max_messages is not None and total > self.max_messages:
+            summary += ", " + str(total - self.max_messages) + " of them not printed"
+        if self.rejects_path is not None:
+            summary += "; see " + self.rejects_path
+        print(summary)
+
+
+# Function that returns the query translator for the engine name
+def get_query_translator(engine):
+    if engine == "numpy":
+        return translate_query_lines_numpy
+    if engine == "bytes":
+        return translate_query_lines_bytes
+    return translate_query_lines
+
+
+# Function that returns the lines of an in-memory transcript processing file as the engine's translator reads them
+def query_lines_from_bytes(data, engine):
+    if engine == "bytes":
+        return io.BytesIO(data)
+    return io.TextIOWrapper(io.BytesIO(data))
+
+
+# Function that joins the output lines written by the engine's translator
+def join_output_lines(output_lines, engine):
+    if engine == "bytes":
+        return b"".join(output_lines)
+    return "".join(output_lines)
+
+
+# Function that translates the query lines one at a time using coord_map
+# output lines are passed to write; unknown transcripts and coordinates are passed to report
+# as (reason, transcript id, transcript coordinate)
+def translate_query_lines(query_lines, coord_map, write, report):
+    for query in prefetch_query_lines(query_lines, coord_map):
         query = query.rstrip()
         queries = re.split(r'\s+', query)
 
         # check format
         check_transcript_line_format(queries)
 
+        if len(queries) == 3:
+            translate_range_query(queries, coord_map, write, report)
+            continue
+
         tr_id = queries[0]
         tr_coord = queries[1]
 
         # checks if the transcript id is known
         if not (tr_id in coord_map):
-            print("Transcript", tr_id, "does not exist in genome mapping file")
+            report(MISS_UNKNOWN_TRANSCRIPT, tr_id, tr_coord)
             continue
 
-        # get the corresponding genomic coordinate for the given transcript coordinate
-        for ch in coord_map[tr_id]:
-            # checks if transcript coordinate is defined
-            if not (int(tr_coord) in coord_map[tr_id][ch]):
-                print("Transcript coordinate", tr_coord, "for transcript", tr_id, "does not exist")
+        # get the corresponding genomic coordinate on every locus of the transcript
+        matches = coord_map[tr_id].lookup(int(tr_coord))
+        # checks if transcript coordinate is defined on any locus
+        if not matches:
+            report(MISS_UNMAPPED_COORDINATE, tr_id, tr_coord)
+            continue
+
+        for ch, genomic_coord in matches:
+            write(tr_id + "\t" + tr_coord + "\t" + ch + "\t" + str(genomic_coord) + "\n")
+
+
+# Function that translates a range query (transcript id, start and end of a half-open transcript range) and writes
+# one row per aligned piece of the range: transcript id, piece start and end on the transcript, chr, and piece
+# start and end on the chromosome. Pieces are split wherever the cigar leaves the alignment (D, N, I or S ops)
+# The range is reported as "start-end" when the transcript is unknown or no part of the range is aligned
+def translate_range_query(queries, coord_map, write, report):
+    tr_id = queries[0]
+    tr_start = int(queries[1])
+    tr_end = int(queries[2])
+    tr_range = queries[1] + "-" + queries[2]
+
+    # checks if the transcript id is known
+    if not (tr_id in coord_map):
+        report(MISS_UNKNOWN_TRANSCRIPT, tr_id, tr_range)
+        return
+
+    pieces = coord_map[tr_id].get_range(tr_start, tr_end)
+    # checks if any part of the range is aligned on any locus
+    if not pieces:
+        report(MISS_UNMAPPED_COORDINATE, tr_id, tr_range)
+        return
+
+    write("".join([tr_id + "\t" + str(start) + "\t" + str(end) + "\t" + ch + "\t" + str(genomic_start) + "\t" +
+                   str(genomic_end) + "\n" for ch, start, end, genomic_start, genomic_end in pieces]))
+
+
+# Function that returns the aligned pieces of the transcript range [tr_start, tr_end) as a list of (transcript start,
+# transcript end, genomic start, genomic end) tuples, from a CigarBlockIndex or a per-base dict of
+# "generate_genomic_dict"
+def map_transcript_range(genomic_map, tr_start, tr_end):
+    if not isinstance(genomic_map, dict):
+        return genomic_map.get_range(tr_start, tr_end)
+    pieces = []
+    for tr_coord in range(tr_start, tr_end):
+        genomic_coord = genomic_map.get(tr_coord)
+        if genomic_coord is None:
+            continue
+        if pieces and pieces[-1][1] == tr_coord and pieces[-1][3] == genomic_coord:
+            pieces[-1] = (pieces[-1][0], tr_coord + 1, pieces[-1][2], genomic_coord + 1)
+        # minus strand pieces grow towards the chromosome start
+        elif pieces and pieces[-1][1] == tr_coord and pieces[-1][2] == genomic_coord + 1:
+            pieces[-1] = (pieces[-1][0], tr_coord + 1, genomic_coord, pieces[-1][3])
+        else:
+            pieces.append((tr_coord, tr_coord + 1, genomic_coord, genomic_coord + 1))
+    return pieces
+
+
+# Function that translates binary query lines one at a time, with the same results and messages as
+# "translate_query_lines" but without decoding: lines are split with bytes operations, the transcript id and
+# coordinate are echoed back as bytes and output lines are passed to write as bytes. Each distinct transcript id
+# is decoded only once, to look up its block indexes in coord_map
+def translate_query_lines_bytes(query_lines, coord_map, write, report):
+    transcript_maps = {}
+    chrom_names = {}
+    memo_size = getattr(coord_map, "translator_memo_size", CIGAR_CACHE_SIZE)
+    for query in prefetch_query_lines(query_lines, coord_map):
+        queries = query.split()
+        if len(queries) != 2 or not queries[1].isdigit() or query[:1].isspace():
+            # decode the lines the bytes fast path cannot handle and translate them like "translate_query_lines"
+            translate_query_lines([query.decode("utf-8")], coord_map, lambda text: write(text.encode("utf-8")),
+                                  report)
+            continue
+
+        tr_id = queries[0]
+        tr_coord = queries[1]
+
+        transcript_map = transcript_maps.get(tr_id)
+        if transcript_map is None:
+            tr = tr_id.decode("utf-8")
+            transcript_map = coord_map[tr] if tr in coord_map else False
+            if len(transcript_maps) >= memo_size:
+                transcript_maps.clear()
+            transcript_maps[tr_id] = transcript_map
+
+        # checks if the transcript id is known
+        if transcript_map is False:
+            report(MISS_UNKNOWN_TRANSCRIPT, tr_id.decode("utf-8"), tr_coord.decode("utf-8"))
+            continue
+
+        # get the corresponding genomic coordinate on every locus of the transcript
+        matches = transcript_map.lookup(int(tr_coord))
+        # checks if transcript coordinate is defined on any locus
+        if not matches:
+            report(MISS_UNMAPPED_COORDINATE, tr_id.decode("utf-8"), tr_coord.decode("utf-8"))
+            continue
+
+        for ch, genomic_coord in matches:
+            ch_name = chrom_names.get(ch)
+            if ch_name is None:
+                ch_name = chrom_names[ch] = ch.encode("utf-8")
+            write(b"%s\t%s\t%s\t%d\n" % (tr_id, tr_coord, ch_name, genomic_coord))
+
+
+# Function that translates the query lines with NumPy, with the same results and messages as "translate_query_lines"
+# The lines are translated in batches of NUMPY_BATCH_LINES, so memory does not grow with the query file. A batch of
+# well-formed point queries is split into transcript ids and coordinates with a single str.split; a batch holding
+# range queries or malformed lines is read line by line
+def translate_query_lines_numpy(query_lines, coord_map, write, report):
+    query_lines = iter(query_lines)
+    while True:
+        batch = list(islice(query_lines, NUMPY_BATCH_LINES))
+        if not batch:
+            break
+        text = "".join(batch)
+        if NUMPY_POINT_QUERIES.fullmatch(text if text.endswith("\n") else text + "\n"):
+            fields = text.split()
+            translate_point_queries_numpy(fields[0::2], fields[1::2], coord_map, write, report)
+        else:
+            translate_query_batch_numpy(batch, coord_map, write, report)
+
+
+# Function that translates a batch of query lines holding range queries or malformed lines for
+# "translate_query_lines_numpy": the point queries between them are translated together
+def translate_query_batch_numpy(batch, coord_map, write, report):
+    tr_ids = []
+    tr_coords = []
+    for query in batch:
+        queries = query.split()
+        if len(queries) != 2 or not queries[1].isdigit() or query[:1].isspace():
+            # translate the point queries read so far first, to keep the output and the messages in query order
+            # also when the line is malformed and exits
+            translate_point_queries_numpy(tr_ids, tr_coords, coord_map, write, report)
+            tr_ids, tr_coords = [], []
+            # fall back to the reference split so malformed lines behave as in "translate_query_lines"
+            queries = re.split(r'\s+', query.rstrip())
+            check_transcript_line_format(queries)
+            if len(queries) == 3:
+                translate_range_query(queries, coord_map, write, report)
                 continue
+        tr_ids.append(queries[0])
+        tr_coords.append(queries[1])
+
+    translate_point_queries_numpy(tr_ids, tr_coords, coord_map, write, report)
+
+
+# Function that translates point queries with NumPy, given as parallel lists of transcript ids and coordinates
+# The aligned blocks of every queried transcript-chr mapping are concatenated into one sorted array of keys
+# (mapping number * stride + transcript offset), so a single searchsorted call finds the block of every query
+def translate_point_queries_numpy(tr_ids, tr_coords, coord_map, write, report):
+    if not tr_ids:
+        return
+    try:
+        positions = np.minimum(np.array(tr_coords, dtype=np.int64), NUMPY_MAX_COORDINATE)
+    except OverflowError:
+        positions = np.array([min(int(tr_coord), NUMPY_MAX_COORDINATE) for tr_coord in tr_coords], dtype=np.int64)
+    # number each distinct transcript id in order of first appearance
+    tr_codes = {}
+    query_tr = np.array([tr_codes.setdefault(tr_id, len(tr_codes)) for tr_id in tr_ids], dtype=np.int64)
+
+    # collect the transcript-chr mappings ("loci") of the queried transcripts: the loci of transcript number code
+    # are numbered from locus_start[code] to locus_start[code] + locus_count[code] - 1
+    known = []
+    locus_start = []
+    locus_count = []
+    loci = []
+    queried_trs = list(tr_codes)
+    for code, tr in enumerate(queried_trs):
+        # coordinate maps that can prefetch (see "SqliteCoordMap") look up the transcripts in batches
+        if code % PREFETCH_LINES == 0 and hasattr(coord_map, "prefetch"):
+            coord_map.prefetch(queried_trs[code:code + PREFETCH_LINES])
+        locus_start.append(len(loci))
+        if tr in coord_map:
+            tr_loci = coord_map[tr].loci
+            known.append(True)
+            locus_count.append(len(tr_loci))
+            loci.extend(tr_loci)
+        else:
+            known.append(False)
+            locus_count.append(0)
+    known = np.array(known, dtype=bool)
+    locus_chrom = [ch for ch, block_index in loci]
+    block_indexes = [block_index for ch, block_index in loci]
+
+    # concatenate the blocks of every locus; the sentinel block at index 0 belongs to no locus and has key -1, so
+    # every searchsorted result below points at a valid block
+    locus_blocks = np.array([len(block_index.tr_starts) for block_index in block_indexes], dtype=np.int64)
+    block_locus = np.concatenate(([-2], np.repeat(np.arange(len(loci), dtype=np.int64), locus_blocks)))
+    block_tr_start = np.array([-1] + list(chain.from_iterable(map(attrgetter("tr_starts"), block_indexes))),
+                              dtype=np.int64)
+    block_length = np.array([0] + list(chain.from_iterable(map(attrgetter("lengths"), block_indexes))), dtype=np.int64)
+    locus_chr_start = np.array([block_index.chr_start_coord for block_index in block_indexes], dtype=np.int64)
+    block_chr_start = np.array([0] + list(chain.from_iterable(map(attrgetter("chr_offsets"), block_indexes))),
+                               dtype=np.int64) + np.concatenate(([0], np.repeat(locus_chr_start, locus_blocks)))
+    locus_step = np.array([-1 if block_index.reverse else 1 for block_index in block_indexes], dtype=np.int64)
+    block_step = np.concatenate(([1], np.repeat(locus_step, locus_blocks)))
+    stride = int((block_tr_start + block_length).max()) + 1
+    block_keys = np.where(block_locus >= 0, block_locus * stride + block_tr_start, -1)
+
+    # table of the locus numbers of each transcript, one column per chr mapping (-1 when absent)
+    locus_start = np.array(locus_start, dtype=np.int64)
+    locus_count = np.array(locus_count, dtype=np.int64)
+    max_loci = max(int(locus_count.max()), 1)
+    ranks = np.arange(max_loci, dtype=np.int64)
+    locus_table = np.where(ranks < locus_count[:, None], locus_start[:, None] + ranks, -1)
+
+    # positions past the end of every block are clipped so the keys cannot spill into the next locus
+    clipped_positions = np.minimum(positions, stride - 1)
+    hit_query, hit_rank, hit_locus, hit_coord = [], [], [], []
+    any_hit = np.zeros(len(positions), dtype=bool)
+    for rank in range(max_loci):
+        query_locus = locus_table[query_tr, rank]
+        has_locus = query_locus >= 0
+        block = np.searchsorted(block_keys, query_locus * stride + clipped_positions, side="right") - 1
+        offset = positions - block_tr_start[block]
+        hit = has_locus & (block_locus[block] == query_locus) & (offset < block_length[block])
+        hit_idx = np.flatnonzero(hit)
+        hit_query.append(hit_idx)
+        hit_rank.append(np.full(len(hit_idx), rank, dtype=np.int64))
+        hit_locus.append(query_locus[hit_idx])
+        hit_coord.append(block_chr_start[block[hit_idx]] + block_step[block[hit_idx]] * offset[hit_idx])
+        any_hit |= hit
+
+    hit_query = np.concatenate(hit_query)
+    hit_rank = np.concatenate(hit_rank)
+    order = np.lexsort((hit_rank, hit_query))
+    hit_query = hit_query[order].tolist()
+    if hit_query:
+        write("\n".join(map("\t".join, zip(map(tr_ids.__getitem__, hit_query), map(tr_coords.__getitem__, hit_query),
+                                            map(locus_chrom.__getitem__, np.concatenate(hit_locus)[order].tolist()),
+                                            map(str, np.concatenate(hit_coord)[order].tolist())))) + "\n")
+
+    # queries translated on no locus are reported once, as unknown transcripts or unmapped coordinates
+    miss_idx = np.flatnonzero(~any_hit)
+    for q, is_known in zip(miss_idx.tolist(), known[query_tr[miss_idx]].tolist()):
+        if is_known:
+            report(MISS_UNMAPPED_COORDINATE, tr_ids[q], tr_coords[q])
+        else:
+            report(MISS_UNKNOWN_TRANSCRIPT, tr_ids[q], tr_coords[q])
+
+
+# Coordinate map, engine and output compression inherited by the worker processes of "merge_transcript_file_parallel"
+_worker_coord_map = None
+_worker_engine = "python"
+_worker_bgzf = False
+
+
+# Function that splits a file into byte ranges of roughly chunk_size bytes that start and end on line boundaries
+def find_line_aligned_chunks(filename, chunk_size):
+    chunks = []
+    file_size = os.path.getsize(filename)
+    f = open(filename, "rb")
+    start = 0
+    while start < file_size:
+        f.seek(min(start + chunk_size, file_size))
+        f.readline()
+        end = min(f.tell(), file_size)
+        chunks.append((start, end))
+        start = end
+    f.close()
+    return chunks
+
+
+# Function that reads an open binary file in blocks of roughly chunk_size bytes that end on line boundaries
+def read_line_aligned_blocks(input_file, chunk_size):
+    while True:
+        data = input_file.read(chunk_size)
+        if not data:
+            break
+        yield data + input_file.readline()
+
+
+# Function run in a worker process: translates the queries in one chunk of the transcript processing file, either
+# a (filename, start, end) byte range or the bytes of the chunk, and returns the output text (compressed to BGZF
+# blocks if requested), the misses, the printed messages, whether the chunk stopped on a format error and the
+# chunk's counters
+def translate_chunk(chunk):
+    if isinstance(chunk, bytes):
+        data = chunk
+    else:
+        filename, start, end = chunk
+        f = open(filename, "rb")
+        f.seek(start)
+        data = f.read(end - start)
+        f.close()
+
+    output_lines = []
+    misses = []
+    failed = False
+    stats = RunStats()
+    cache_counters = {}
+    if hasattr(_worker_coord_map, "cache_counters"):
+        cache_counters = _worker_coord_map.cache_counters()
+    query_lines, write, report = stats.instrument(query_lines_from_bytes(data, _worker_engine), output_lines.append,
+                                                  lambda *miss: misses.append(miss))
+    # messages printed by the translation (a format error) are returned, so that the main process prints them after
+    # the misses of the earlier chunks
+    messages = io.StringIO()
+    with redirect_stdout(messages):
+        try:
+            get_query_translator(_worker_engine)(query_lines, _worker_coord_map, write, report)
+        except SystemExit:
+            failed = True
+    for name, value in cache_counters.items():
+        stats.count(name, _worker_coord_map.cache_counters()[name] - value)
+    output_text = join_output_lines(output_lines, _worker_engine)
+    if _worker_bgzf:
+        output_text = bgzf_compress(output_text if _worker_engine == "bytes" else output_text.encode())
+    return output_text, misses, messages.getvalue(), failed, stats.counters
+
+
+# Function that translates the transcript processing file with a pool of forked worker processes
+# A plain file is split into line-aligned byte ranges read by the workers; a compressed file or stdin is
+# decompressed here and sent to the workers in line-aligned blocks. Workers inherit coord_map copy-on-write,
+# so the genome mapping file is parsed only once, and the results of each chunk are written back in the original
+# input order. With compression="bgzf" each worker compresses its own output to BGZF blocks
+def merge_transcript_file_parallel(transcript_processing_filename, coord_map, output, workers, engine="python",
+                                   chunk_size=16 * 1024 * 1024, stats=None, report=None,
+                                   buffer_size=DEFAULT_WRITE_BUFFER_SIZE, compression=None):
+    global _worker_coord_map, _worker_engine, _worker_bgzf
+    input_file = None
+    if transcript_processing_filename == "-" or is_compressed(transcript_processing_filename):
+        input_file = open_input(transcript_processing_filename, True)
+        chunks = read_line_aligned_blocks(input_file, chunk_size)
+    else:
+        file_size = os.path.getsize(transcript_processing_filename)
+        chunk_size = max(1, min(chunk_size, file_size // workers + 1))
+        chunks = [(transcript_processing_filename, start, end)
+                  for start, end in find_line_aligned_chunks(transcript_processing_filename, chunk_size)]
+
+    _worker_coord_map = coord_map
+    _worker_engine = engine
+    _worker_bgzf = compression == "bgzf"
+    if report is None:
+        report = print_miss
+    if _worker_bgzf:
+        output_file = BatchWriter(output, True, buffer_size, "none")
+    else:
+        output_file = BatchWriter(output, engine == "bytes", buffer_size, compression)
+    pool = multiprocessing.get_context("fork").Pool(workers)
+    try:
+        for output_text, misses, messages, failed, chunk_counters in pool.imap(translate_chunk, chunks):
+            output_file.write(output_text)
+            for miss in misses:
+                report(*miss)
+            sys.stdout.write(messages)
+            if stats is not None:
+                for name, value in chunk_counters.items():
+                    stats.count(name, value)
+            if failed:
+                sys.exit()
+        if _worker_bgzf:
+            output_file.write(BGZF_EOF)
+    finally:
+        pool.terminate()
+        output_file.close()
+        if input_file is not None:
+            close_input(input_file)
+        _worker_coord_map = None
+
+
+# Class holding the aligned blocks of every transcript on one chromosome for genomic to transcript lookups
+# The chromosome is cut into elementary segments at every block start and end; each segment stores the ids of the
+# blocks covering it, so a lookup is a single binary search over the segment starts. Matches are returned in
+# genome mapping file order. Each block is (transcript, genomic start, transcript coordinate at the genomic start,
+# length, step), where step is -1 for minus strand blocks whose transcript coordinate decreases along the genome
+class GenomicBlockIndex:
+    __slots__ = ("segment_starts", "segment_blocks", "block_transcripts", "block_chr_starts", "block_tr_starts",
+                 "block_steps")
+
+    def __init__(self, blocks):
+        boundaries = set()
+        for tr, chr_start, tr_start, length, step in blocks:
+            boundaries.add(chr_start)
+            boundaries.add(chr_start + length)
+        self.segment_starts = sorted(boundaries)
+        covering = [[] for _ in self.segment_starts]
+        for block_id, (tr, chr_start, tr_start, length, step) in enumerate(blocks):
+            first = bisect_left(self.segment_starts, chr_start)
+            last = bisect_left(self.segment_starts, chr_start + length)
+            for segment in range(first, last):
+                covering[segment].append(block_id)
+        self.segment_blocks = [tuple(block_ids) for block_ids in covering]
+        self.block_transcripts = [block[0] for block in blocks]
+        self.block_chr_starts = [block[1] for block in blocks]
+        self.block_tr_starts = [block[2] for block in blocks]
+        self.block_steps = [block[4] for block in blocks]
+
+    # returns a list of (transcript id, transcript coordinate) pairs covering the genomic coordinate
+    def lookup(self, chr_coord):
+        segment = bisect_right(self.segment_starts, chr_coord) - 1
+        if segment < 0:
+            return []
+        return [(self.block_transcripts[block_id],
+                 self.block_tr_starts[block_id] + self.block_steps[block_id] * (chr_coord -
+                                                                                self.block_chr_starts[block_id]))
+                for block_id in self.segment_blocks[segment]]
+
+
+# Function that returns a dictionary of GenomicBlockIndex keyed by chr for reverse (genomic to transcript) lookups
+def build_genomic_block_index(transcript_to_genomic_dict):
+    chr_blocks = {}
+    for tr in transcript_to_genomic_dict:
+        for alignment in transcript_to_genomic_dict[tr]:
+            blocks = chr_blocks.setdefault(alignment.chrom, [])
+            tr_length = transcript_length(alignment.cigar) if alignment.reverse else 0
+            for tr_start, chr_offset, length in zip(*compile_cigar_blocks(alignment.cigar)):
+                if alignment.reverse:
+                    # the transcript coordinate of the first cigar base of the block, which is at its genomic start
+                    tr_start = tr_length - 1 - tr_start
+                blocks.append((tr, alignment.start_coord + chr_offset, tr_start, length,
+                               -1 if alignment.reverse else 1))
+    return {ch: GenomicBlockIndex(blocks) for ch, blocks in chr_blocks.items()}
+
+
+# Function to read in a genomic query file (chr and 0-based genomic coordinate per line) and write every transcript
+# and transcript coordinate covering each genomic coordinate to output
+# Misses are passed to report as MISS_UNKNOWN_CHROMOSOME or MISS_UNCOVERED_COORDINATE with the chr and coordinate
+# (by default printed, see "print_miss" and "MissReporter")
+def reverse_merge_genomic_file(genomic_query_filename, genomic_index, output, report=None,
+                               buffer_size=DEFAULT_WRITE_BUFFER_SIZE):
+    genomic_query_file = open_file(genomic_query_filename, "r")
+    output_file = BatchWriter(output, False, buffer_size)
+    if report is None:
+        report = print_miss
+    # the rows batched before a malformed query line exits are still written
+    try:
+        reverse_query_lines(genomic_query_file, genomic_index, output_file.write, report)
+    finally:
+        genomic_query_file.close()
+        output_file.close()
+
+
+# Function that translates the genomic query lines for "reverse_merge_genomic_file", passing the output lines to write
+def reverse_query_lines(query_lines, genomic_index, write, report):
+    for query in query_lines:
+        query = query.rstrip()
+        queries = re.split(r'\s+', query)
+
+        # check format
+        check_genomic_line_format(queries)
+
+        ch = queries[0]
+        chr_coord = queries[1]
+
+        # checks if the chromosome is known
+        if not (ch in genomic_index):
+            report(MISS_UNKNOWN_CHROMOSOME, ch, chr_coord)
+            continue
+
+        matches = genomic_index[ch].lookup(int(chr_coord))
+        # checks if any transcript covers the genomic coordinate
+        if not matches:
+            report(MISS_UNCOVERED_COORDINATE, ch, chr_coord)
+            continue
+
+        write("".join([ch + "\t" + chr_coord + "\t" + tr + "\t" + str(tr_coord) + "\n" for tr, tr_coord in matches]))
+
+
+# Function to verify genomic query file format
+def check_genomic_line_format(genomic_line_arr):
+    # check number of columns
+    if not len(genomic_line_arr) == 2:
+        print("Error! Genomic query file must contain 2 columns")
+        sys.exit()
+
+    # check second column for integers only
+    if not genomic_line_arr[1].isdigit():
+        print("Error! Genomic coordinates must be integers")
+        sys.exit()
+
+
+# Function that returns the liftover file format ("bed" or "gtf") of a filename, judging by its extension
+def detect_liftover_format(filename):
+    name = filename.lower()
+    if is_compressed(name):
+        name = os.path.splitext(name)[0]
+    if os.path.splitext(name)[1] in (".gtf", ".gff", ".gff3"):
+        return "gtf"
+    return "bed"
+
+
+# Function to read in a BED or GTF/GFF3 file whose first column is a transcript id and write every interval lifted
+# over to genomic coordinates, with one row per aligned piece of the interval (see "map_transcript_range")
+# BED rows keep their name, score and strand columns (the block columns of BED12 rows are dropped); GTF/GFF rows
+# keep every column but the coordinates, with the frame of a split feature adjusted to the start of each piece
+# The strand of intervals lifted to a minus strand alignment is flipped
+# Header and comment lines are copied. Intervals that cannot be lifted are written unchanged to the unmapped file
+# if one is given, and otherwise reported like the misses of "merge_transcript_file"
+def liftover_file(input_filename, coord_map, output, file_format="bed", unmapped=None,
+                  buffer_size=DEFAULT_WRITE_BUFFER_SIZE):
+    input_file = open_input(input_filename)
+    output_file = BatchWriter(output, False, buffer_size)
+    unmapped_file = None if unmapped is None else BatchWriter(unmapped, False, buffer_size)
+    # the rows batched before a malformed line exits are still written
+    try:
+        liftover_lines(input_file, coord_map, output_file, unmapped_file, file_format == "gtf")
+    finally:
+        close_input(input_file)
+        output_file.close()
+        if unmapped_file is not None:
+            unmapped_file.close()
+
+
+# Function that lifts over the lines of a BED (or with gtf=True, GTF/GFF3) file for "liftover_file", writing the
+# lifted rows to output_file and the intervals that cannot be lifted to unmapped_file if it is not None
+def liftover_lines(input_file, coord_map, output_file, unmapped_file, gtf):
+    for line in input_file:
+        if not line.strip() or line.startswith(("#", "track", "browser")):
+            output_file.write(line.rstrip("\r\n") + "\n")
+            continue
+        fields = line.rstrip("\r\n").split("\t")
 
-            output_file.write(tr_id + "\t" + tr_coord + "\t" + ch + "\t" + str(
-                coord_map[tr_id][ch][int(tr_coord)]) + "\n")
+        # check format
+        check_liftover_line_format(fields, gtf)
+
+        tr_id = fields[0]
+        if gtf:
+            tr_start = int(fields[3]) - 1
+            tr_end = int(fields[4])
+            tr_range = fields[3] + "-" + fields[4]
+        else:
+            tr_start = int(fields[1])
+            tr_end = int(fields[2])
+            tr_range = fields[1] + "-" + fields[2]
+
+        frame = fields[7] if gtf else ""
+        interval_strand = fields[6] if gtf else fields[5] if len(fields) > 5 else ""
+        lifted = []
+        miss = MISS_UNKNOWN_TRANSCRIPT
+        if tr_id in coord_map:
+            miss = MISS_UNMAPPED_COORDINATE
+            for ch, block_index in coord_map[tr_id].loci:
+                strand = FLIPPED_STRANDS.get(interval_strand, interval_strand) if block_index.reverse \
+                    else interval_strand
+                for start, end, genomic_start, genomic_end in block_index.get_range(tr_start, tr_end):
+                    if gtf:
+                        fields[0] = ch
+                        fields[3] = str(genomic_start + 1)
+                        fields[4] = str(genomic_end)
+                        fields[6] = strand
+                        if frame.isdigit():
+                            fields[7] = str((int(frame) - (start - tr_start)) % 3)
+                        lifted.append("\t".join(fields) + "\n")
+                    else:
+                        lifted.append("\t".join([ch, str(genomic_start), str(genomic_end)] + fields[3:5] +
+                                                 ([strand] if len(fields) > 5 else [])) + "\n")
+
+        # checks if any part of the interval is aligned
+        if not lifted:
+            if unmapped_file is not None:
+                unmapped_file.write(line.rstrip("\r\n") + "\n")
+            else:
+                print_miss(miss, tr_id, tr_range)
+            continue
+        output_file.write("".join(lifted))
+
+
+# Function to verify the format of a BED or GTF/GFF3 line of a liftover file
+def check_liftover_line_format(fields, gtf):
+    # check number of columns
+    if gtf and not len(fields) == 9:
+        print("Error! GTF/GFF file must contain 9 columns")
+        sys.exit()
+    if not gtf and len(fields) < 3:
+        print("Error! BED file must contain at least 3 columns")
+        sys.exit()
+
+    # check start and end columns for integers only, with a 1-based start in GTF/GFF files
+    start, end = (fields[3], fields[4]) if gtf else (fields[1], fields[2])
+    if not (start.isdigit() and end.isdigit()) or (gtf and int(start) < 1):
+        print("Error! Interval coordinates must be integers")
+        sys.exit()
+
+    # check that the interval does not end before it starts
+    if int(end) < int(start) - (1 if gtf else 0):
+        print("Error! Interval end must not be before its start")
+        sys.exit()
 
+
+# Function that sends one length-prefixed frame over a socket
+def send_frame(sock, data):
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+
+# Function that receives one length-prefixed frame from a socket
+def recv_frame(sock):
+    header = recv_exact(sock, FRAME_HEADER.size)
+    return recv_exact(sock, FRAME_HEADER.unpack(header)[0])
+
+
+# Function that receives exactly size bytes from a socket
+def recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("connection closed before the whole frame was received")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+# Class handling one client connection of the "serve" daemon
+# The request frame holds the contents of a transcript processing file; the reply holds a status byte
+# (1 if the batch stopped on a format error or any other error, such as a file that is not UTF-8), the output text
+# and everything the translation printed
+class TranslationRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data = recv_frame(self.request)
+        output_lines = []
+        messages = io.StringIO()
+        failed = False
+        with redirect_stdout(messages):
+            try:
+                get_query_translator(self.server.engine)(query_lines_from_bytes(data, self.server.engine),
+                                                         self.server.coord_map, output_lines.append, print_miss)
+            except SystemExit:
+                failed = True
+            except Exception as error:
+                print("Error! " + str(error))
+                failed = True
+        output_text = join_output_lines(output_lines, self.server.engine)
+        send_frame(self.request, b"\1" if failed else b"\0")
+        send_frame(self.request, output_text if self.server.engine == "bytes" else output_text.encode("utf-8"))
+        send_frame(self.request, messages.getvalue().encode("utf-8"))
+
+
+# Function that keeps coord_map loaded and answers translation requests on a Unix domain socket until interrupted
+# Requests are handled one at a time, so printed messages can be captured per request
+# A socket left at socket_path by an earlier daemon is replaced, but any other file there is kept
+def serve_coord_map(coord_map, socket_path, engine="python"):
+    if os.path.exists(socket_path):
+        if not is_socket(socket_path):
+            print("Error! " + socket_path + " exists and is not a socket")
+            sys.exit()
+        os.unlink(socket_path)
+    server = socketserver.UnixStreamServer(socket_path, TranslationRequestHandler)
+    server.coord_map = coord_map
+    server.engine = engine
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+# Function that returns whether path is a Unix domain socket
+def is_socket(path):
+    return stat.S_ISSOCK(os.stat(path).st_mode)
+
+
+# Function that sends the transcript processing file to a "serve" daemon and writes its results to output,
+# producing the same output file and messages as "merge_transcript_file"
+def query_server(socket_path, transcript_processing_filename, output):
+    transcript_processing_file = open_file(transcript_processing_filename, "rb")
+    data = transcript_processing_file.read()
     transcript_processing_file.close()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    send_frame(sock, data)
+    failed = recv_frame(sock) == b"\1"
+    output_text = recv_frame(sock).decode("utf-8")
+    messages = recv_frame(sock).decode("utf-8")
+    sock.close()
+
+    output_file = open_file(output, "w")
+    output_file.write(output_text)
     output_file.close()
+    sys.stdout.write(messages)
+    if failed:
+        sys.exit()
 
 
 # Function to verify transcript processing file format
 def check_transcript_line_format(transcript_line_arr):
-    # check number of columns
-    if not len(transcript_line_arr) == 2:
-        print("Error! Transcript Processing File must contain 2 columns")
+    # check number of columns (a third column makes the line a range query)
+    if not len(transcript_line_arr) in (2, 3):
+        print("Error! Transcript Processing File must contain 2 columns, or 3 for a range query")
         sys.exit()
 
-    # check second column for integers only
-    if not transcript_line_arr[1].isdigit():
+    # check second and third columns for integers only
+    if not all(coord.isdigit() for coord in transcript_line_arr[1:]):
         print("Error! Transcript coordinates must be integers")
         sys.exit()
 
+    # check that a range does not end before it starts
+    if len(transcript_line_arr) == 3 and int(transcript_line_arr[2]) < int(transcript_line_arr[1]):
+        print("Error! Transcript range end must not be before its start")
+        sys.exit()
+
+
+# Class collecting the wall and CPU time of each stage of a run and counters such as rows parsed, queries answered
+# and misses, written as a JSON report by --stats-json. The CPU time of a stage includes that of the worker
+# processes it waited for
+class RunStats:
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    # context manager timing the enclosed block as the named stage
+    @contextmanager
+    def stage(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = process_tree_cpu_time()
+        try:
+            yield
+        finally:
+            stage_times = self.stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0})
+            stage_times["wall_seconds"] += time.perf_counter() - wall_start
+            stage_times["cpu_seconds"] += process_tree_cpu_time() - cpu_start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    # returns the query lines, write and report callbacks of a translator wrapped so that they update the counters
+    def instrument(self, query_lines, write, report):
+        def counted_lines():
+            for query in query_lines:
+                self.count("queries")
+                yield query
+
+        def counted_write(text):
+            self.count("output_rows", text.count(b"\n" if isinstance(text, bytes) else "\n"))
+            write(text)
+
+        def counted_report(reason, tr_id, tr_coord):
+            self.count(reason.lower() + "_misses")
+            report(reason, tr_id, tr_coord)
+
+        return counted_lines(), counted_write, counted_report
+
+    # writes the stage times, counters and peak memory (of this process and of its worker processes) to path
+    def write_json(self, path):
+        # a query is either answered with one or more output rows (one per locus, or per piece of a range) or
+        # reported once as a miss
+        if "queries" in self.counters:
+            self.counters["queries_answered"] = self.counters["queries"] - sum(
+                [self.counters.get(reason.lower() + "_misses", 0)
+                 for reason in (MISS_UNKNOWN_TRANSCRIPT, MISS_UNMAPPED_COORDINATE)])
+        report = {"stages": self.stages, "counters": self.counters}
+        if resource is not None:
+            # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+            scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+            report["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+            report["peak_worker_rss_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+        stats_file = open(path, "w")
+        json.dump(report, stats_file, indent=2, sort_keys=True)
+        stats_file.write("\n")
+        stats_file.close()
+
+
+# Function that returns the CPU time of this process plus that of its terminated and waited for child processes
+# (such as the workers of "merge_transcript_file_parallel"), in seconds
+def process_tree_cpu_time():
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+# Function that adds the arguments describing the genome mapping file, shared by every command that reads one
+def add_mapping_arguments(parser):
+    parser.add_argument("--mapping-format", required=False, dest="mapping_format", choices=MAPPING_FORMATS,
+                        help="format of the genome mapping file: cigar (transcript, chr, position, CIGAR string and "
+                             "optional strand) or gtf (GTF/GFF3 exon records). Default: gtf for .gtf, .gff and "
+                             ".gff3 files, otherwise cigar")
+    parser.add_argument("--all-loci", action="store_true", dest="all_loci",
+                        help="keep every row of a transcript that is aligned to several loci instead of only its "
+                             "last row, and write a row for each locus covering a query. Index files and alignment "
+                             "stores keep the loci they were built with")
+
+
+# Function to validate the genome mapping file or index file of a command and return custom error message for
+# invalid inputs
+def validate_mapping_args(input_args):
+    index_file = getattr(input_args, "index_file", None)
+    if index_file is not None and not os.path.isfile(index_file):
+        return False, "Index file does not exist"
+    if input_args.genome_mapping_file is not None and not os.path.isfile(input_args.genome_mapping_file):
+        return False, "Genome mapping file does not exist"
+    if input_args.all_loci and input_args.genome_mapping_file is None:
+        return False, "All loci mode requires a genome mapping file; index files and alignment stores keep the loci " \
+                      "they were built with"
+    return True, ""
+
 
 # Function to validate the input files and return custom error message for invalid inputs
 def validate_input_args(input_args):
-    if not os.path.isfile(input_args.genome_mapping_file):
-        return False, "Genome mapping file does not exist"
-    if not os.path.isfile(input_args.transcript_processing_file):
+    if input_args.store_file is not None:
+        if sqlite3 is None:
+            return False, "The alignment store requires the sqlite3 module"
+        if not os.path.isfile(input_args.store_file):
+            return False, "Alignment store does not exist"
+        if input_args.store_cache_size < 1:
+            return False, "Store cache size must be at least 1"
+    elif input_args.index_file is None and input_args.genome_mapping_file is None:
+        return False, "Either a genome mapping file, an index file or an alignment store is required"
+    (is_input_valid, msg) = validate_mapping_args(input_args)
+    if not is_input_valid:
+        return False, msg
+    if input_args.transcript_processing_file != "-" and not os.path.isfile(input_args.transcript_processing_file):
         return False, "Transcript processing file does not exist"
-    if not os.path.isdir(os.path.dirname(os.path.abspath(input_args.output_file))):
+    if input_args.output_file != "-" and not os.path.isdir(os.path.dirname(os.path.abspath(input_args.output_file))):
         return False, "Output file location does not exist"
+    if input_args.transcript_processing_file == "-" and input_args.selective_load:
+        return False, "Reading the transcript processing file from stdin cannot be combined with selective loading"
+    if input_args.write_buffer_size < 1:
+        return False, "Write buffer size must be at least 1 byte"
+    if input_args.stats_json is not None and not os.path.isdir(os.path.dirname(os.path.abspath(input_args.stats_json))):
+        return False, "Stats file location does not exist"
+    if input_args.rejects is not None and not os.path.isdir(os.path.dirname(os.path.abspath(input_args.rejects))):
+        return False, "Rejects file location does not exist"
+    if input_args.max_miss_messages is not None and input_args.max_miss_messages < 0:
+        return False, "Maximum number of miss messages must not be negative"
+    if input_args.workers < 1:
+        return False, "Number of workers must be at least 1"
+    if input_args.workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        return False, "Multiple workers require the fork start method, which is not available on this platform"
+    if input_args.engine == "numpy" and np is None:
+        return False, "The numpy engine requires NumPy to be installed"
+    if input_args.sorted_inputs and (input_args.index_file is not None or input_args.store_file is not None or
+                                     input_args.workers > 1):
+        return False, "Sorted inputs mode cannot be combined with an index file, an alignment store or multiple workers"
+    if input_args.sorted_inputs and input_args.engine == "numpy":
+        return False, "Sorted inputs mode cannot be combined with the numpy engine, which holds a batch of transcripts"
+    uses_cache = input_args.cache_entries is not None or input_args.cache_memory is not None or input_args.per_base
+    if uses_cache and (input_args.genome_mapping_file is None or input_args.sorted_inputs):
+        return False, "The transcript cache requires a genome mapping file and cannot be combined with sorted inputs"
+    if input_args.cache_entries is not None and input_args.cache_entries < 1:
+        return False, "Cache size must be at least 1 transcript"
+    if input_args.cache_memory is not None and input_args.cache_memory <= 0:
+        return False, "Cache memory budget must be positive"
+    if input_args.per_base and input_args.engine == "numpy":
+        return False, "Per-base transcript maps cannot be used with the numpy engine"
+    if input_args.sorted_inputs and (input_args.mapping_format or
+                                     detect_mapping_format(input_args.genome_mapping_file)) == "gtf":
+        return False, "Sorted inputs mode requires a genome mapping file with CIGAR strings"
 
     return True, ""
 
 
 # Function that executes the entire workflow
-def transcript_to_genomic_coordinates(genome_mapping_file, transcript_processing_file, output):
-    transcript_genomic_alignment = create_transcript_genomic_dict(genome_mapping_file)
-    genomic_coords = map_coordinates(transcript_genomic_alignment)
-    merge_transcript_file(transcript_processing_file, genomic_coords, output)
+# with lazy=True transcripts are compiled on their first query instead of all up front
+# with selective=True the transcript processing file is read twice: once to collect the queried transcript ids,
+# so that only their rows are loaded from the genome mapping file, and once to answer the queries
+# engine selects how the queries are answered: "python" (line by line) or "numpy" (batches of queries at once)
+# with workers > 1 the queries are split across that many forked worker processes
+# if index_file is given, the coordinates are read from that compiled index instead of the genome mapping file
+# with sorted_inputs=True both files must be sorted by transcript id and are read together in a single merge pass
+# if stats_json is given, a JSON report of the stage times, counters and peak memory is written to that path
+# if rejects is given, misses are written to that file with a reason code instead of being printed one by one;
+# max_miss_messages limits the number of printed misses. Either option prints a summary count of the misses
+# the transcript processing file may be "-" for stdin and output may be "-" or an open file such as sys.stdout;
+# the output rows are written in batches of about buffer_size bytes
+# input and output files ending in .gz, .bz2 or .xz are (de)compressed on the fly; with bgzf=True the output is
+# written as BGZF blocks instead, compressed by the workers when there are several
+# if store_file is given, the coordinates are looked up in that SQLite alignment store, with an LRU cache of
+# store_cache_size transcripts, instead of loading the genome mapping file into memory
+# with cache_entries and/or cache_bytes, only that many (or that large) compiled transcripts are kept in an LRU
+# cache, and with per_base=True transcripts are compiled into per-base dicts (see "CachedCoordMap")
+# with all_loci=True every row of a transcript in the genome mapping file is kept and a query is translated to each
+# locus that covers it, instead of only to the last row of the transcript
+# mapping_format is the format of the genome mapping file, "cigar" or "gtf" (GTF/GFF3 exons), chosen by its name
+# if it is None
+def transcript_to_genomic_coordinates(genome_mapping_file, transcript_processing_file, output, lazy=False,
+                                      selective=False, engine="python", workers=1, index_file=None,
+                                      sorted_inputs=False, stats_json=None, rejects=None, max_miss_messages=None,
+                                      buffer_size=DEFAULT_WRITE_BUFFER_SIZE, bgzf=False, store_file=None,
+                                      store_cache_size=STORE_CACHE_SIZE, cache_entries=None, cache_bytes=None,
+                                      per_base=False, all_loci=False, mapping_format=None):
+    compression = "bgzf" if bgzf else None
+    stats = RunStats() if stats_json is not None else None
+    bytes_read = 0
+    report = None
+    if rejects is not None or max_miss_messages is not None:
+        report = MissReporter(rejects, max_miss_messages)
 
+    if sorted_inputs:
+        with run_stage(stats, "query"):
+            genomic_coords = SortedMergeCoordMap(genome_mapping_file, all_loci)
+            merge_transcript_file(transcript_processing_file, genomic_coords, output, engine, stats, report,
+                                  buffer_size, compression)
+            genomic_coords.close()
+        if stats is not None:
+            stats.count("rows_parsed", genomic_coords.rows_parsed)
+            stats.count("cigar_ops", genomic_coords.cigar_ops)
+        bytes_read += os.path.getsize(genome_mapping_file) + input_size(transcript_processing_file)
+    else:
+        if index_file is not None:
+            with run_stage(stats, "load"):
+                genomic_coords = MappedCoordMap(index_file)
+        elif store_file is not None:
+            with run_stage(stats, "load"):
+                genomic_coords = SqliteCoordMap(store_file, store_cache_size)
+        else:
+            with run_stage(stats, "load"):
+                transcript_ids = None
+                if selective:
+                    transcript_ids = collect_query_transcript_ids(transcript_processing_file)
+                    bytes_read += os.path.getsize(transcript_processing_file)
+                transcript_genomic_alignment = create_transcript_genomic_dict(genome_mapping_file, transcript_ids,
+                                                                              stats, all_loci, mapping_format)
+            bytes_read += os.path.getsize(genome_mapping_file)
 
-######################################################################
-######################################################################
-#######  MAIN  #######################################################
-######################################################################
-######################################################################
+            with run_stage(stats, "compile"):
+                if cache_entries is not None or cache_bytes is not None or per_base:
+                    genomic_coords = CachedCoordMap(transcript_genomic_alignment, cache_entries, cache_bytes, per_base)
+                elif lazy:
+                    genomic_coords = LazyCoordMap(transcript_genomic_alignment)
+                else:
+                    genomic_coords = map_coordinates(transcript_genomic_alignment)
 
-if __name__ == "__main__":
-    parser = ArgumentParser()
+        with run_stage(stats, "query"):
+            if workers > 1:
+                merge_transcript_file_parallel(transcript_processing_file, genomic_coords, output, workers, engine,
+                                               stats=stats, report=report, buffer_size=buffer_size,
+                                               compression=compression)
+            else:
+                merge_transcript_file(transcript_processing_file, genomic_coords, output, engine, stats, report,
+                                      buffer_size, compression)
+        bytes_read += input_size(transcript_processing_file)
+        if stats is not None and hasattr(genomic_coords, "cache_counters"):
+            for name, value in genomic_coords.cache_counters().items():
+                stats.count(name, value)
+
+    if report is not None:
+        report.close()
+    if stats is not None:
+        stats.count("bytes_read", bytes_read)
+        if isinstance(output, str) and output != "-":
+            stats.count("bytes_written", os.path.getsize(output))
+        stats.write_json(stats_json)
+
+
+# Function that returns a context manager timing a stage in stats, or doing nothing if stats is None
+def run_stage(stats, name):
+    if stats is None:
+        return nullcontext()
+    return stats.stage(name)
+
+
+# Function that executes the "build-index" command: compiles the genome mapping file into an index file
+def build_index_main(argv):
+    parser = ArgumentParser(prog="translate_transcript_to_genomic_coords.py build-index")
+    parser.add_argument("--genome-mapping-file", required=True, dest="genome_mapping_file",
+                        help="file containing the transcripts (e.g., input_file1.txt)")
+    parser.add_argument("--output", required=True, dest="output_file",
+                        help="Filename for the compiled index file")
+    add_mapping_arguments(parser)
+    args = parser.parse_args(argv)
+
+    (is_input_valid, msg) = validate_mapping_args(args)
+    if not is_input_valid:
+        sys.stderr.write(msg + "\n")
+        sys.exit(-1)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(args.output_file))):
+        sys.stderr.write("Output file location does not exist\n")
+        sys.exit(-1)
+
+    build_index_file(create_transcript_genomic_dict(args.genome_mapping_file, all_loci=args.all_loci,
+                                                    mapping_format=args.mapping_format), args.output_file)
+
+
+# Function that executes the "build-store" command: ingests the genome mapping file into a SQLite alignment store
+def build_store_main(argv):
+    parser = ArgumentParser(prog="translate_transcript_to_genomic_coords.py build-store")
+    parser.add_argument("--genome-mapping-file", required=True, dest="genome_mapping_file",
+                        help="file containing the transcripts (e.g., input_file1.txt)")
+    parser.add_argument("--output", required=True, dest="output_file",
+                        help="Filename for the SQLite alignment store")
+    add_mapping_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if sqlite3 is None:
+        sys.stderr.write("The alignment store requires the sqlite3 module\n")
+        sys.exit(-1)
+    (is_input_valid, msg) = validate_mapping_args(args)
+    if not is_input_valid:
+        sys.stderr.write(msg + "\n")
+        sys.exit(-1)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(args.output_file))):
+        sys.stderr.write("Output file location does not exist\n")
+        sys.exit(-1)
+
+    build_sqlite_store(args.genome_mapping_file, args.output_file, all_loci=args.all_loci,
+                       mapping_format=args.mapping_format)
+
+
+# Function that executes the "reverse" command: translates genomic coordinates to transcript coordinates
+def reverse_main(argv):
+    parser = ArgumentParser(prog="translate_transcript_to_genomic_coords.py reverse")
     parser.add_argument("--genome-mapping-file", required=True, dest="genome_mapping_file",
                         help="file containing the transcripts (e.g., input_file1.txt)")
+    parser.add_argument("--genomic-query-file", required=True, dest="genomic_query_file",
+                        help="file containing a chromosome and 0-based genomic coordinate per line")
+    add_mapping_arguments(parser)
+    parser.add_argument("--output", required=False, dest="output_file", default='output.txt',
+                        help="Filename for output file. Default: output.txt)")
+    parser.add_argument("--rejects", required=False, dest="rejects",
+                        help="write genomic queries that could not be translated to this file with a reason code "
+                             "instead of printing them, and print a summary count")
+    parser.add_argument("--max-miss-messages", required=False, dest="max_miss_messages", type=int,
+                        help="print at most this many untranslated genomic queries, followed by a summary count")
+    args = parser.parse_args(argv)
+
+    (is_input_valid, msg) = validate_mapping_args(args)
+    if not is_input_valid:
+        sys.stderr.write(msg + "\n")
+        sys.exit(-1)
+    if not os.path.isfile(args.genomic_query_file):
+        sys.stderr.write("Genomic query file does not exist\n")
+        sys.exit(-1)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(args.output_file))):
+        sys.stderr.write("Output file location does not exist\n")
+        sys.exit(-1)
+    if args.rejects is not None and not os.path.isdir(os.path.dirname(os.path.abspath(args.rejects))):
+        sys.stderr.write("Rejects file location does not exist\n")
+        sys.exit(-1)
+    if args.max_miss_messages is not None and args.max_miss_messages < 0:
+        sys.stderr.write("Maximum number of miss messages must not be negative\n")
+        sys.exit(-1)
+
+    genomic_index = build_genomic_block_index(create_transcript_genomic_dict(args.genome_mapping_file,
+                                                                             all_loci=args.all_loci,
+                                                                             mapping_format=args.mapping_format))
+    report = None
+    if args.rejects is not None or args.max_miss_messages is not None:
+        report = MissReporter(args.rejects, args.max_miss_messages,
+                              reasons=(MISS_UNKNOWN_CHROMOSOME, MISS_UNCOVERED_COORDINATE))
+    reverse_merge_genomic_file(args.genomic_query_file, genomic_index, args.output_file, report)
+    if report is not None:
+        report.close()
+
+
+# Function that executes the "liftover" command: lifts BED or GTF/GFF3 intervals on transcripts over to the genome
+def liftover_main(argv):
+    parser = ArgumentParser(prog="translate_transcript_to_genomic_coords.py liftover")
+    mapping_group = parser.add_mutually_exclusive_group(required=True)
+    mapping_group.add_argument("--genome-mapping-file", dest="genome_mapping_file",
+                               help="file containing the transcripts (e.g., input_file1.txt)")
+    mapping_group.add_argument("--index", dest="index_file",
+                               help="compiled index file written by the build-index command")
+    parser.add_argument("--input", required=True, dest="input_file",
+                        help="BED or GTF/GFF3 file of intervals whose first column is a transcript id, or - for stdin")
+    parser.add_argument("--format", required=False, dest="file_format", choices=("bed", "gtf"),
+                        help="format of the input file. Default: gtf for .gtf, .gff and .gff3 files, otherwise bed")
+    add_mapping_arguments(parser)
+    parser.add_argument("--output", required=False, dest="output_file", default='output.txt',
+                        help="Filename for output file, or - for stdout. Default: output.txt)")
+    parser.add_argument("--unmapped", required=False, dest="unmapped_file",
+                        help="write the intervals that could not be lifted over to this file instead of printing "
+                             "a message for each of them")
+    args = parser.parse_args(argv)
+
+    (is_input_valid, msg) = validate_mapping_args(args)
+    if not is_input_valid:
+        sys.stderr.write(msg + "\n")
+        sys.exit(-1)
+    if args.input_file != "-" and not os.path.isfile(args.input_file):
+        sys.stderr.write("Input file does not exist\n")
+        sys.exit(-1)
+    if args.output_file != "-" and not os.path.isdir(os.path.dirname(os.path.abspath(args.output_file))):
+        sys.stderr.write("Output file location does not exist\n")
+        sys.exit(-1)
+    if args.unmapped_file is not None and not os.path.isdir(os.path.dirname(os.path.abspath(args.unmapped_file))):
+        sys.stderr.write("Unmapped file location does not exist\n")
+        sys.exit(-1)
+
+    if args.index_file is not None:
+        coord_map = MappedCoordMap(args.index_file)
+    else:
+        coord_map = LazyCoordMap(create_transcript_genomic_dict(args.genome_mapping_file, all_loci=args.all_loci,
+                                                                mapping_format=args.mapping_format))
+    file_format = args.file_format
+    if file_format is None:
+        file_format = detect_liftover_format(args.input_file)
+
+    # when the lifted intervals go to stdout, the messages are printed to stderr so that they do not mix with them
+    output = args.output_file
+    messages = nullcontext()
+    if output == "-":
+        output = sys.stdout
+        messages = redirect_stdout(sys.stderr)
+    with messages:
+        liftover_file(args.input_file, coord_map, output, file_format, args.unmapped_file)
+
+
+# Function that executes the "serve" command: loads the coordinate map once and answers requests on a Unix socket
+def serve_main(argv):
+    parser = ArgumentParser(prog="translate_transcript_to_genomic_coords.py serve")
+    mapping_group = parser.add_mutually_exclusive_group(required=True)
+    mapping_group.add_argument("--genome-mapping-file", dest="genome_mapping_file",
+                               help="file containing the transcripts (e.g., input_file1.txt)")
+    mapping_group.add_argument("--index", dest="index_file",
+                               help="compiled index file written by the build-index command")
+    parser.add_argument("--socket", required=True, dest="socket_path",
+                        help="path of the Unix domain socket to listen on")
+    add_mapping_arguments(parser)
+    parser.add_argument("--lazy", action="store_true", dest="lazy",
+                        help="compile each transcript on its first query instead of compiling every transcript up front")
+    parser.add_argument("--engine", required=False, dest="engine", default="python", choices=ENGINES,
+                        help="query engine: python (line by line), bytes (line by line without decoding) "
+                             "or numpy (vectorized batch). Default: python")
+    args = parser.parse_args(argv)
+
+    (is_input_valid, msg) = validate_mapping_args(args)
+    if not is_input_valid:
+        sys.stderr.write(msg + "\n")
+        sys.exit(-1)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(args.socket_path))):
+        sys.stderr.write("Socket location does not exist\n")
+        sys.exit(-1)
+    if os.path.exists(args.socket_path) and not is_socket(args.socket_path):
+        sys.stderr.write("Socket path exists and is not a socket\n")
+        sys.exit(-1)
+    if args.engine == "numpy" and np is None:
+        sys.stderr.write("The numpy engine requires NumPy to be installed\n")
+        sys.exit(-1)
+
+    if args.index_file is not None:
+        coord_map = MappedCoordMap(args.index_file)
+    else:
+        transcript_to_genomic_dict = create_transcript_genomic_dict(args.genome_mapping_file, all_loci=args.all_loci,
+                                                                    mapping_format=args.mapping_format)
+        if args.lazy:
+            coord_map = LazyCoordMap(transcript_to_genomic_dict)
+        else:
+            coord_map = map_coordinates(transcript_to_genomic_dict)
+    serve_coord_map(coord_map, args.socket_path, args.engine)
+
+
+# Function that executes the "query" command: the client of the "serve" command
+def query_main(argv):
+    parser = ArgumentParser(prog="translate_transcript_to_genomic_coords.py query")
+    parser.add_argument("--socket", required=True, dest="socket_path",
+                        help="path of the Unix domain socket of a running serve command")
     parser.add_argument("--transcript-processing-file", required=True, dest="transcript_processing_file",
                         help="file containing a set of queries (e.g., input_file2.txt")
     parser.add_argument("--output", required=False, dest="output_file", default='output.txt',
                         help="Filename for output file. Default: output.txt)")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.socket_path):
+        sys.stderr.write("Socket does not exist\n")
+        sys.exit(-1)
+    if not os.path.isfile(args.transcript_processing_file):
+        sys.stderr.write("Transcript processing file does not exist\n")
+        sys.exit(-1)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(args.output_file))):
+        sys.stderr.write("Output file location does not exist\n")
+        sys.exit(-1)
+
+    query_server(args.socket_path, args.transcript_processing_file, args.output_file)
+
+
+# Function that executes the default command: translates transcript coordinates to genomic coordinates
+def translate_main(argv):
+    parser = ArgumentParser()
+    mapping_group = parser.add_mutually_exclusive_group(required=True)
+    mapping_group.add_argument("--genome-mapping-file", dest="genome_mapping_file",
+                               help="file containing the transcripts (e.g., input_file1.txt)")
+    mapping_group.add_argument("--index", dest="index_file",
+                               help="compiled index file written by the build-index command")
+    mapping_group.add_argument("--store", dest="store_file",
+                               help="SQLite alignment store written by the build-store command, for mappings that do "
+                                    "not fit in memory")
+    add_mapping_arguments(parser)
+    parser.add_argument("--transcript-processing-file", required=True, dest="transcript_processing_file",
+                        help="file containing a set of queries (e.g., input_file2.txt, or - for stdin")
+    parser.add_argument("--output", required=False, dest="output_file", default='output.txt',
+                        help="Filename for output file, or - for stdout. Default: output.txt)")
+    parser.add_argument("--lazy", action="store_true", dest="lazy",
+                        help="compile each transcript on its first query instead of compiling every transcript up front")
+    parser.add_argument("--selective-load", action="store_true", dest="selective_load",
+                        help="pre-scan the transcript processing file and only load the genome mapping rows "
+                             "of the transcripts it references")
+    parser.add_argument("--engine", required=False, dest="engine", default="python", choices=ENGINES,
+                        help="query engine: python (line by line), bytes (line by line without decoding) "
+                             "or numpy (vectorized batch). Default: python")
+    parser.add_argument("--workers", required=False, dest="workers", type=int, default=1,
+                        help="number of worker processes used to translate the queries. Default: 1")
+    parser.add_argument("--sorted-inputs", action="store_true", dest="sorted_inputs",
+                        help="both input files are sorted by transcript id: read them together in one merge pass "
+                             "that holds a single transcript in memory")
+    parser.add_argument("--stats-json", required=False, dest="stats_json",
+                        help="write a JSON report of the stage times, counters and peak memory to this file")
+    parser.add_argument("--rejects", required=False, dest="rejects",
+                        help="write queries that could not be translated to this file with a reason code "
+                             "instead of printing them, and print a summary count")
+    parser.add_argument("--max-miss-messages", required=False, dest="max_miss_messages", type=int,
+                        help="print at most this many untranslated queries, followed by a summary count")
+    parser.add_argument("--write-buffer-size", required=False, dest="write_buffer_size", type=int,
+                        default=DEFAULT_WRITE_BUFFER_SIZE,
+                        help="size in bytes of the batches written to the output file. Default: 1048576")
+    parser.add_argument("--bgzf", action="store_true", dest="bgzf",
+                        help="write the output as BGZF (block gzip), compressed in parallel by the workers")
+    parser.add_argument("--store-cache-size", required=False, dest="store_cache_size", type=int,
+                        default=STORE_CACHE_SIZE,
+                        help="number of transcripts read from --store that are cached in memory. Default: 65536")
+    parser.add_argument("--cache-entries", required=False, dest="cache_entries", type=int,
+                        help="compile transcripts on their first query and keep at most this many of them, "
+                             "evicting the least recently used")
+    parser.add_argument("--cache-memory", required=False, dest="cache_memory", type=float,
+                        help="like --cache-entries, with a budget of this many megabytes of compiled transcripts")
+    parser.add_argument("--per-base", action="store_true", dest="per_base",
+                        help="compile transcripts into per-base dictionaries for constant time lookups; "
+                             "use with --cache-entries or --cache-memory to bound their memory")
+    args = parser.parse_args(argv)
 
     (is_input_valid, msg) = validate_input_args(args)
     if not is_input_valid:
         sys.stderr.write(msg + "\n")
         sys.exit(-1)
 
-transcript_to_genomic_coordinates(args.genome_mapping_file,
-                                  args.transcript_processing_file,
-                                  args.output_file)
+    # when the output rows go to stdout, the messages are printed to stderr so that they do not mix with them
+    output = args.output_file
+    messages = nullcontext()
+    if output == "-":
+        output = sys.stdout
+        messages = redirect_stdout(sys.stderr)
+    with messages:
+        transcript_to_genomic_coordinates(args.genome_mapping_file,
+                                          args.transcript_processing_file,
+                                          output,
+                                          lazy=args.lazy,
+                                          selective=args.selective_load,
+                                          engine=args.engine,
+                                          workers=args.workers,
+                                          index_file=args.index_file,
+                                          sorted_inputs=args.sorted_inputs,
+                                          stats_json=args.stats_json,
+                                          rejects=args.rejects,
+                                          max_miss_messages=args.max_miss_messages,
+                                          buffer_size=args.write_buffer_size,
+                                          bgzf=args.bgzf,
+                                          store_file=args.store_file,
+                                          store_cache_size=args.store_cache_size,
+                                          cache_entries=args.cache_entries,
+                                          cache_bytes=None if args.cache_memory is None else
+                                          int(args.cache_memory * 1024 * 1024),
+                                          per_base=args.per_base,
+                                          all_loci=args.all_loci,
+                                          mapping_format=args.mapping_format)
+
+
+# Function that runs the command named by the first argument, or the default translation if no command is given
+def main(argv):
+    commands = {
+        "build-index": build_index_main,
+        "build-store": build_store_main,
+        "reverse": reverse_main,
+        "liftover": liftover_main,
+        "serve": serve_main,
+        "query": query_main,
+    }
+    if argv and argv[0] in commands:
+        commands[argv[0]](argv[1:])
+    else:
+        translate_main(argv)
+
+
+######################################################################
+######################################################################
+#######  MAIN  #######################################################
+######################################################################
+######################################################################
+
+if __name__ == "__main__":
+    main(sys.argv[1:])